@@ -0,0 +1,92 @@
+'''
+Times the JSON encoding of the payloads of the question endpoints with jsonify and with every installed
+encoder, as a whole ('response') and as the question endpoints build them ('questions_response').
+From the backend folder run:
+
+    python benchmarks/json_encoders.py [--questions 10] [--number 2000]
+
+It needs no database, the questions are made up with the shape of Question.format().
+'''
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+from responses import JSON_ENCODERS, JsonResponder
+
+CATEGORIES = {1: 'Science', 2: 'Art', 3: 'Geography', 4: 'History', 5: 'Entertainment', 6: 'Sports'}
+
+def make_questions(count):
+    return [{
+        'id': i,
+        'question': 'Which dung beetle was worshipped by the ancient Egyptians? ({})'.format(i),
+        'answer': 'Scarab',
+        'category': i % 6 + 1,
+        'difficulty': i % 5 + 1,
+    } for i in range(1, count + 1)]
+
+def make_payloads(count):
+    questions = make_questions(count)
+    return {
+        'GET /questions': ('questions', {
+            'success': True,
+            'questions': questions,
+            'total_questions': 1000,
+            'categories': CATEGORIES,
+            'current_category': sorted(set(question['category'] for question in questions)),
+        }),
+        'POST /questions': ('questions', {
+            'success': True,
+            'questions': questions,
+            'total_questions': count,
+            'facets': {'category': {'1': count}, 'difficulty': {'1': count}},
+            'current_category': None,
+        }),
+        'POST /play/round': ('questions', {
+            'category': 0,
+            'previous_questions': [],
+            'questions': questions[:5],
+        }),
+        'POST /quizzes/<id>/next': ('question', {
+            'success': True,
+            'question': questions[0],
+            'remaining': 4,
+        }),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=10, help='questions per list payload')
+    parser.add_argument('--number', type=int, default=2000, help='encodings timed per payload')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    payloads = make_payloads(args.questions)
+
+    def us(encode):
+        return timeit.timeit(encode, number=args.number) / args.number * 1e6
+
+    print('{:<26}{:<10}{:>14}{:>24}'.format('payload', 'encoder', 'response us', 'questions_response us'))
+    with app.app_context():
+        for endpoint, (key, payload) in payloads.items():
+            print('{:<26}{:<10}{:>14.1f}'.format(endpoint, 'jsonify', us(lambda: jsonify(payload))))
+
+    for name, encoder in JSON_ENCODERS.items():
+        try:
+            responder = JsonResponder(encoder())
+        except ImportError:
+            print('{:<26}{:<10}{:>12}'.format('', name, 'not installed'))
+            continue
+
+        with app.app_context():
+            for endpoint, (key, payload) in payloads.items():
+                print('{:<26}{:<10}{:>14.1f}{:>24.1f}'.format(
+                    endpoint, name, us(lambda: responder.response(payload)),
+                    us(lambda: responder.questions_response(payload, key))))
+
+if __name__ == '__main__':
+    main()
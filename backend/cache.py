@@ -0,0 +1,57 @@
+import hashlib
+import json
+import threading
+import time
+
+from models import Category
+
+'''
+CategorySnapshot
+    an immutable copy of the categories table with an ETag computed from its content,
+    so that every worker serving the same categories sends the same ETag
+'''
+class CategorySnapshot:
+
+  def __init__(self, categories, version):
+    self.categories = [category.format() for category in categories]
+    self.types = {category.id: category.type for category in categories}
+    self.version = version
+    digest = hashlib.sha1(json.dumps(self.categories, sort_keys=True).encode('utf-8')).hexdigest()
+    self.etag = f'categories-{digest[:16]}'
+    self.loaded_at = time.monotonic()
+
+'''
+CategoryCache(ttl)
+    keeps the categories in memory instead of querying them on every request.
+    invalidate() drops the snapshot and bumps the version, it is called on every category write
+    in this process. Writes made by other worker processes are picked up after 'ttl' seconds.
+'''
+class CategoryCache:
+
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self.version = 0
+    self._snapshot = None
+    self._lock = threading.Lock()
+
+  def get(self):
+    snapshot = self._snapshot
+    if snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl:
+      return snapshot
+
+    with self._lock:
+      snapshot = self._snapshot
+      if snapshot is None or time.monotonic() - snapshot.loaded_at >= self.ttl:
+        self.version += 1
+        snapshot = CategorySnapshot(Category.query.order_by(Category.id).all(), self.version)
+        self._snapshot = snapshot
+    return snapshot
+
+  def invalidate(self):
+    with self._lock:
+      self._snapshot = None
+      self.version += 1
+
+  def on_change(self, model, action, instance):
+    if model is Category:
+      self.invalidate()
@@ -1,17 +1,349 @@
 import os
-from flask import Flask, request, abort, jsonify
+import base64
+import bisect
+import json
+from collections import Counter
+import random
+import functools
+import time
+from datetime import timezone
+import io
+import click
+from flask import Flask, request, abort, current_app, g
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy import and_
 
-from models import setup_db, Question, Category
+from models import setup_db, check_schema, db, on_change, Question, Category, QuestionCount, DataVersion
+import migrations
+from cache import CategoryCache
+from quiz import QuestionPool, make_session_store, new_session_id, shuffled_deck
+import search
+from responses import JsonResponder, Compressor, load_encoder
+from writes import WriteBehindQueue
+from routing import ReplicaRouter, REPLICA_BIND_PREFIX
+from metrics import RequestMetrics, instrument_queries
+from importer import import_questions, IMPORT_FORMATS, IMPORT_BATCH_SIZE, MIN_DIFFICULTY, MAX_DIFFICULTY
 
 QUESTIONS_PER_PAGE = 10
+STICKY_COOKIE = 'read_primary_until'
+IMPORT_MIMETYPES = {'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl', 'text/csv': 'csv', 'text/plain': 'copy'}
+IMPORT_EXTENSIONS = {'jsonl': 'jsonl', 'ndjson': 'jsonl', 'csv': 'csv', 'psql': 'copy', 'copy': 'copy'}
+QUESTIONS_PER_PLAY = 5
+SUGGESTIONS_PER_PREFIX = 5
+
+'''
+paginate_questions(query, page)
+    pushes the page window of a question query down to the database with LIMIT/OFFSET,
+    so only the rows of the requested page are fetched and formatted
+'''
+def paginate_questions(query, page):
+  start = (page - 1) * QUESTIONS_PER_PAGE
+  if start < 0:
+    return []
+
+  return Question.format_all(query.order_by(Question.id).offset(start).limit(QUESTIONS_PER_PAGE))
+
+'''
+encode_cursor(*key) / decode_cursor(cursor)
+    an opaque cursor is the url-safe base64 of the JSON list of the last row's sort key,
+    e.g. [id] for all questions or [category, id] for the questions of a category.
+    An empty cursor means the first page. A malformed cursor raises ValueError.
+'''
+def encode_cursor(*key):
+  return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+  if not cursor:
+    return None
+
+  try:
+    padding = '=' * (-len(cursor) % 4)
+    key = json.loads(base64.urlsafe_b64decode((cursor + padding).encode('ascii')).decode('utf-8'))
+  except Exception:
+    raise ValueError('malformed cursor')
+
+  if not isinstance(key, list) or not key or not all(isinstance(value, int) for value in key):
+    raise ValueError('malformed cursor')
+  return key
+
+'''
+seek_questions(query, cursor, category=None, limit=QUESTIONS_PER_PAGE)
+    keyset pagination: seeks past the id stored in the cursor instead of skipping rows with OFFSET,
+    so every page of 'limit' questions is an index range scan on the primary key (or on (category, id)).
+    Returns the formatted page and the cursor of the next page, or None on the last page.
+'''
+def seek_questions(query, cursor, category=None, limit=QUESTIONS_PER_PAGE):
+  key = decode_cursor(cursor)
+
+  if key is not None:
+    if category is None:
+      if len(key) != 1:
+        raise ValueError('cursor does not belong to this listing')
+      last_id = key[0]
+    else:
+      if len(key) != 2 or key[0] != category:
+        raise ValueError('cursor does not belong to this category')
+      last_id = key[1]
+    query = query.filter(Question.id > last_id)
+
+  # fetch one extra row to know whether there is a next page
+  formatted_questions = Question.format_all(query.order_by(Question.id).limit(limit + 1))
+
+  next_cursor = None
+  if len(formatted_questions) > limit:
+    formatted_questions = formatted_questions[:limit]
+    last_id = formatted_questions[-1]['id']
+    next_cursor = encode_cursor(last_id) if category is None else encode_cursor(category, last_id)
+
+  return formatted_questions, next_cursor
+
+'''
+seek_ids(ids, cursor, limit=QUESTIONS_PER_PAGE)
+    keyset pagination over a sorted list of question ids held in memory.
+    Returns the 'limit' ids of the page and the cursor of the next page, or None on the last page.
+'''
+def seek_ids(ids, cursor, limit=QUESTIONS_PER_PAGE):
+  key = decode_cursor(cursor)
+
+  start = 0
+  if key is not None:
+    if len(key) != 1:
+      raise ValueError('cursor does not belong to this listing')
+    start = bisect.bisect_right(ids, key[0])
+
+  page_ids = ids[start:start + limit]
+
+  next_cursor = None
+  if start + limit < len(ids):
+    next_cursor = encode_cursor(page_ids[-1])
+
+  return page_ids, next_cursor
+
+'''
+question_criteria(body)
+    the filter of a bulk request on questions and its list of ids, from 'ids', a list of question ids,
+    and/or 'category' and 'difficulty'. Raises ValueError if there is none,
+    so that a bulk request never applies to every question by mistake.
+'''
+def question_criteria(body):
+  criteria = []
+
+  ids = body.get('ids')
+  if ids is not None:
+    if not isinstance(ids, list) or not ids:
+      raise ValueError("'ids' must be a list of question ids")
+    ids = [int(question_id) for question_id in ids]
+    criteria.append(Question.id.in_(ids))
+
+  for field in ('category', 'difficulty'):
+    if body.get(field) is not None:
+      criteria.append(getattr(Question, field) == int(body[field]))
+
+  if not criteria:
+    raise ValueError('a bulk request needs ids, a category or a difficulty')
+  return and_(*criteria), ids
+
+'''
+question_values(values)
+    the validated columns of a bulk update, 'question', 'answer', 'category' and 'difficulty'.
+    Raises ValueError for any other key or a blank text or a difficulty that is not 1 to 5.
+'''
+def question_values(values):
+  if not isinstance(values, dict) or not values:
+    raise ValueError("'set' must be an object of the columns to update")
+
+  validated = {}
+  for field, value in values.items():
+    if field in ('question', 'answer'):
+      if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{field}' must not be blank")
+      validated[field] = value
+    elif field == 'category':
+      validated[field] = int(value)
+    elif field == 'difficulty':
+      validated[field] = int(value)
+      if not MIN_DIFFICULTY <= validated[field] <= MAX_DIFFICULTY:
+        raise ValueError(f"'difficulty' must be from {MIN_DIFFICULTY} to {MAX_DIFFICULTY}")
+    else:
+      raise ValueError(f"'{field}' cannot be updated")
+  return validated
+
+# HTTP dates have whole seconds and may be naive or aware depending on the werkzeug version
+def utc_seconds(moment):
+  if moment.tzinfo is not None:
+    moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+  return moment.replace(microsecond=0)
+
+'''
+conditional(view)
+    makes a GET view conditional on the data version (models.DataVersion). If the client sends back the
+    ETag in 'If-None-Match', or else a time not older than the last write in 'If-Modified-Since',
+    the answer is '304 Not Modified' before the view runs any query.
+    Otherwise the response of the view gets the ETag and Last-Modified of the data version.
+'''
+def conditional(view):
+  @functools.wraps(view)
+  def conditional_view(*args, **kwargs):
+    version, updated_at = DataVersion.get()
+    etag = f'data-{version}'
+
+    if request.if_none_match:
+      not_modified = request.if_none_match.contains_weak(etag)
+    else:
+      not_modified = request.if_modified_since is not None and utc_seconds(request.if_modified_since) >= utc_seconds(updated_at)
+
+    if not_modified:
+      response = current_app.response_class(status=304)
+    else:
+      response = current_app.make_response(view(*args, **kwargs))
+
+    if response.status_code in (200, 304):
+      # the same data is sent gzipped or not, so the tag is weak
+      response.set_etag(etag, weak=True)
+      response.last_modified = updated_at
+      response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+  return conditional_view
+
+'''
+reads_own_writes()
+    whether the client of the request wrote less than 'REPLICA_STICKY_SECONDS' ago,
+    as told by the cookie set by after_request, and must read from the primary to see its own writes
+'''
+def reads_own_writes():
+  try:
+    return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+  except ValueError:
+    return False
+
+'''
+read_only(view)
+    sends the queries of a view that only reads to a replica picked by the ReplicaRouter of the app, if it has one.
+    A client that reads its own writes reads from the primary. If the replica fails during the request,
+    the view is run again on the primary.
+'''
+def read_only(view):
+  @functools.wraps(view)
+  def read_only_view(*args, **kwargs):
+    g.read_only = True
+    router = current_app.extensions.get('replica_router')
+    if router is None or reads_own_writes():
+      return view(*args, **kwargs)
+
+    g.replica = router.choose()
+    try:
+      response = view(*args, **kwargs)
+      if not g.get('replica_failed'):
+        return response
+    except Exception:
+      if not g.get('replica_failed'):
+        raise
+
+    # the view only reads, so it is safe to run it again
+    db.session.rollback()
+    g.replica = None
+    g.replica_failed = False
+    return view(*args, **kwargs)
+
+  return read_only_view
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  app.config.from_mapping(
+    CATEGORY_CACHE_TTL=60,
+    QUESTION_POOL_TTL=60,
+    QUIZ_SESSION_BACKEND='memory',
+    QUIZ_SESSION_TTL=3600,
+    SEARCH_MODE='substring',
+    SEARCH_RESULT_LIMIT=QUESTIONS_PER_PAGE,
+    SEARCH_RESULT_MAX_LIMIT=100,
+    SEARCH_INDEX=False,
+    SEARCH_INDEX_TTL=60,
+    FRAGMENT_CACHE_SIZE=10000,
+    JSON_ENCODER='auto',
+    JSON_COMPACT=False,
+    COMPRESS_MIN_SIZE=500,
+    COMPRESS_LEVEL=6,
+    COMPRESS_BR_LEVEL=4,
+    IMPORT_BATCH_SIZE=IMPORT_BATCH_SIZE,
+    WRITE_BEHIND=False,
+    WRITE_BEHIND_INTERVAL_MS=50,
+    WRITE_BEHIND_BATCH_SIZE=100,
+    WRITE_BEHIND_MAX_PENDING=10000,
+    WRITE_BEHIND_TICKET_TTL=600,
+    REPLICA_SELECTION='round_robin',
+    REPLICA_RETRY_SECONDS=30,
+    REPLICA_STICKY_SECONDS=5,
+    SQL_COUNT_HEADERS=None,
+    METRICS_DIR=os.environ.get('METRICS_DIR'),
+    METRICS_FLUSH_SECONDS=1.0,
+  )
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  if 'SQLALCHEMY_DATABASE_URI' in app.config:
+    setup_db(app, app.config['SQLALCHEMY_DATABASE_URI'])
+  else:
+    setup_db(app)
+
+  # the SQL statements of each request are counted, and reported in headers in debug mode or with SQL_COUNT_HEADERS
+  instrument_queries()
+
+  # requests, latencies, SQL and JSON time per route for GET '/metrics', shared by the workers through METRICS_DIR
+  request_metrics = RequestMetrics(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_SECONDS'])
+  app.extensions['request_metrics'] = request_metrics
+
+  # the read-only endpoints read from the replicas of DATABASE_REPLICA_URLS, if there are any
+  replicas = sorted(name for name in app.config['SQLALCHEMY_BINDS'] if name.startswith(REPLICA_BIND_PREFIX))
+  if replicas:
+    app.extensions['replica_router'] = ReplicaRouter(db, app, replicas, app.config['REPLICA_SELECTION'], app.config['REPLICA_RETRY_SECONDS'])
+
+  # categories rarely change, keep them in memory and drop them on every category write
+  category_cache = CategoryCache(app.config['CATEGORY_CACHE_TTL'])
+  app.extensions['category_cache'] = category_cache
+  on_change(app, 'category_cache', category_cache.on_change)
+
+  # ids of the questions of every category, to draw quiz questions without scanning the category
+  question_pool = QuestionPool(app.config['QUESTION_POOL_TTL'], lambda: category_cache.get().types)
+  app.extensions['question_pool'] = question_pool
+  on_change(app, 'question_pool', question_pool.on_change)
+
+  # words of every question and answer, to answer searches without the database
+  search_index = None
+  if app.config['SEARCH_INDEX']:
+    search_index = search.InvertedIndex(app.config['SEARCH_INDEX_TTL'])
+    with app.app_context():
+      search_index.refresh()
+    app.extensions['search_index'] = search_index
+    on_change(app, 'search_index', search_index.on_change)
+
+  # completions of the search box, built on the first suggestion
+  suggester = search.Suggester(app.config['SEARCH_INDEX_TTL'])
+  app.extensions['suggester'] = suggester
+  on_change(app, 'suggester', suggester.on_change)
+
+  # every response is encoded by the fastest JSON encoder installed, or the one of JSON_ENCODER.
+  # It keeps the JSON of the questions most recently read, list responses are assembled from it.
+  responder = JsonResponder(load_encoder(app.config['JSON_ENCODER']), app.config['JSON_COMPACT'], app.config['FRAGMENT_CACHE_SIZE'])
+  app.extensions['responder'] = responder
+  on_change(app, 'fragments', responder.fragments.on_change)
+
+  # gzip or brotli for JSON responses large enough to be worth it
+  compressor = Compressor(app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_LEVEL'], app.config['COMPRESS_BR_LEVEL'])
+
+  # questions added with POST '/add' are committed in batches, if enabled
+  write_queue = None
+  if app.config['WRITE_BEHIND']:
+    write_queue = WriteBehindQueue(app, app.config['WRITE_BEHIND_INTERVAL_MS'] / 1000, app.config['WRITE_BEHIND_BATCH_SIZE'],
+                                   app.config['WRITE_BEHIND_MAX_PENDING'], app.config['WRITE_BEHIND_TICKET_TTL'])
+    app.extensions['write_queue'] = write_queue
+
+  # shuffled decks of the quizzes being played
+  quiz_sessions = make_session_store(app.config)
+  app.extensions['quiz_sessions'] = quiz_sessions
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -22,14 +354,91 @@ def create_app(test_config=None):
   @TODO: Use the after_request decorator to set Access-Control-Allow
   '''
   '''
-  This web page allows 'GET', 'POST', 'DELETE' methods.
+  This web page allows 'GET', 'POST', 'PATCH', 'DELETE' methods.
+  JSON responses are compressed as the 'Accept-Encoding' of the request allows.
+  With replicas, a client that writes reads from the primary for the next 'REPLICA_STICKY_SECONDS'.
+  In debug mode, or with 'SQL_COUNT_HEADERS', 'X-SQL-Queries' and 'X-SQL-Time-Ms' tell how many SQL statements
+  the request ran and how long they took.
+  Every request is counted in the metrics of GET '/metrics' with its latency, SQL time and JSON encode time.
   '''
+  @app.before_request
+  def before_request():
+    g.request_start = time.perf_counter()
+
   @app.after_request
   def after_request(response):
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, DELETE')
+    response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE')
+    sql_count_headers = app.config['SQL_COUNT_HEADERS']
+    if sql_count_headers or (sql_count_headers is None and app.debug):
+      response.headers['X-SQL-Queries'] = str(g.get('sql_queries', 0))
+      response.headers['X-SQL-Time-Ms'] = '{:.3f}'.format(g.get('sql_time', 0.0) * 1000)
+    if replicas and request.method in ('POST', 'PATCH', 'DELETE') and not g.get('read_only') and response.status_code < 400:
+      sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+      response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds, httponly=True, samesite='Lax')
+    response = compressor.compress(response, request.accept_encodings)
+
+    # requests of unknown urls are counted together, so that scanners cannot add routes to the metrics
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_metrics.observe(route, request.method, response.status_code, time.perf_counter() - g.get('request_start', time.perf_counter()),
+                            g.get('sql_time', 0.0), g.get('json_encode_time', 0.0))
     return response
 
+  '''
+  flask recount-questions
+    - Repairs the cached question counts by recounting the questions table
+  '''
+  @app.cli.command('recount-questions')
+  def recount_questions():
+    total = QuestionCount.recount()
+    click.echo(f'Recounted {total} questions.')
+
+  '''
+  flask import-questions FILE [--format jsonl|csv|copy] [--batch-size N]
+    - Imports the questions of a file, '-' for standard input, as POST '/questions/import' does.
+      The format is guessed from the file extension if it is not given, '.psql' and '.copy' are 'copy'.
+  '''
+  @app.cli.command('import-questions')
+  @click.argument('file', type=click.File('r', encoding='utf-8'))
+  @click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS), help='jsonl, csv or copy')
+  @click.option('--batch-size', type=int, default=lambda: app.config['IMPORT_BATCH_SIZE'], help='rows per COPY or INSERT')
+  def import_questions_command(file, import_format, batch_size):
+    if import_format is None:
+      extension = os.path.splitext(file.name)[1].lstrip('.')
+      import_format = IMPORT_EXTENSIONS.get(extension)
+      if import_format is None:
+        raise click.UsageError(f'cannot guess the format of {file.name}, pass --format')
+
+    result = import_questions(file, import_format, batch_size, error_limit=None)
+    for error in result.errors:
+      click.echo(f"line {error['line']}: {error['message']}", err=True)
+    click.echo(f'Imported {result.imported} questions, rejected {result.total_errors}.')
+
+  '''
+  flask db upgrade
+    - Applies the migrations the database is missing, then checks the schema against the models
+  flask db check
+    - Checks the schema version and the tables and indexes against the models
+  '''
+  db_cli = AppGroup('db', help='Manage the database schema.')
+
+  @db_cli.command('upgrade')
+  def upgrade_db():
+    version = migrations.upgrade(db.engine, echo=click.echo)
+    check_schema()
+    click.echo(f'The database is at schema version {version}.')
+
+  @db_cli.command('check')
+  def check_db():
+    with db.engine.connect() as connection:
+      version = migrations.current_version(connection)
+    if version is None or version < migrations.latest_version():
+      raise click.ClickException(f'The database is at schema version {version}, the latest is {migrations.latest_version()}.')
+    check_schema()
+    click.echo(f'The database is at schema version {version} and matches the models.')
+
+  app.cli.add_command(db_cli)
+
 
   '''
   @TODO: 
@@ -47,21 +456,30 @@ def create_app(test_config=None):
        '4' : "History",
        '5' : "Entertainment",
        '6' : "Sports"}
+    - The response has an 'ETag'. If the request sends it back in 'If-None-Match' and the categories 
+      have not changed, the response is '304 Not Modified' without a body.
   '''
   @app.route('/categories', methods=['GET'])
+  @read_only
   def get_all_categories():
     try:
-      categories = Category.query.all()
-      formatted_categories = [category.format() for category in categories]
-   
-      return jsonify({
-        'success': True,
-        'categories': formatted_categories
-      })
-    
+      snapshot = category_cache.get()
     except:
       abort(422)
 
+    # the client already has these categories, the tag it sends back is weak if the response was compressed
+    if request.if_none_match.contains_weak(snapshot.etag):
+      response = app.response_class(status=304)
+    else:
+      response = responder.response({
+        'success': True,
+        'categories': snapshot.categories
+      })
+
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 
   '''
   @TODO: 
@@ -78,9 +496,12 @@ def create_app(test_config=None):
   '''
   GET '/questions'
     - Fetches a dictionary of categories, a list of questions, number of total questions, current category
-    - Request Arguments: None or 'page'
+    - Request Arguments: None or 'page' or 'cursor'
       - 'page' is an integer number.  
       - None is equal to 'page=1'.
+      - 'cursor' is an opaque string from 'next_cursor' of the previous response. 
+        An empty 'cursor' starts from the first question. 
+        With a cursor, the page is found by seeking on the question id, not by skipping rows.
     - Returns: An object with four keys,
       - 'categories' that contains an object of id: category_string key:value pairs
       - 'current_category' that is an id of category. In this route, 'current_category' is 'None'. 'None' is a default category.
@@ -93,37 +514,48 @@ def create_app(test_config=None):
           "question": "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"
         }
       - 'total_questions' that is the number of total questions
+      - 'next_cursor', only if 'cursor' is given, that is the cursor of the next page or 'None' on the last page
     - Error: 404, if the value of the 'page' is beyond the number of total pages. 
+    - Error: 400, if the 'cursor' is malformed. 
+    - The response has a weak 'ETag' and a 'Last-Modified' of the last write to the questions or categories.
+      If the request sends either back in 'If-None-Match' or 'If-Modified-Since' and nothing has been written since,
+      the response is '304 Not Modified' without a body.
   '''
   @app.route('/questions', methods=['GET'])
+  @read_only
+  @conditional
   def get_questions():
     
     page = request.args.get('page', 1, type=int)
-    start = (page -1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    cursor = request.args.get('cursor')
   
     current_categories = None
+    response = {}
 
-    questions = Question.query.all()
-    formatted_questions = [question.format() for question in questions]
-  
-    categories = Category.query.all()
-  
-    formatted_categories = {}
-    
-    for category in categories:
-      formatted_categories[category.id] = category.type 
+    if cursor is None:
+      formatted_questions = paginate_questions(Question.query, page)
+    else:
+      try:
+        formatted_questions, response['next_cursor'] = seek_questions(Question.query, cursor)
+      except ValueError:
+        abort(400)
 
-    if len(formatted_questions[start:end]) == 0:
+    if len(formatted_questions) == 0:
       abort(404)
-    else:  
-      return jsonify({
-        'success': True,
-        'questions': formatted_questions[start:end],
-        'total_questions': len(formatted_questions),
-        'categories': formatted_categories,
-        'current_category': current_categories
-      })
+
+    total_questions = QuestionCount.get()
+
+    formatted_categories = category_cache.get().types
+
+    response.update({
+      'success': True,
+      'questions': formatted_questions,
+      'total_questions': total_questions,
+      'categories': formatted_categories,
+      'current_category': current_categories
+    })
+
+    return responder.questions_response(response, 'questions')
 
 
   '''
@@ -156,12 +588,90 @@ def create_app(test_config=None):
       abort(422)
     else: 
       deleted_question.delete()
-      return jsonify({
+      return responder.response({
         'success': True,
         'question': deleted_question.format()
       }) 
      
 
+  '''
+  DELETE '/questions'
+    - Deletes many questions at once with a single statement, e.g. to clean up a bad import.
+    - Request Arguments: 'ids', a list of question ids, and/or 'category' and 'difficulty', at least one of them.
+      Only the questions matching all of them are deleted. Optional 'strict'.
+      - 'strict' set to true deletes nothing and fails with 422 if any of 'ids' is not a question,
+        or if no question matches, as DELETE '/questions/<int:question_id>' does for a single id.
+    - Returns: An object with the keys
+      - 'deleted' that is the number of deleted questions
+      - 'not_found', only with 'ids', the ids that are not questions
+    - Error: 400, if there are neither 'ids' nor a filter, or they are not integers.
+    - Error: 422, in 'strict' mode, if a question is missing.
+  '''
+  @app.route('/questions', methods=['DELETE'])
+  def delete_questions():
+    body = request.get_json(silent=True) or {}
+    try:
+      criteria, ids = question_criteria(body)
+    except (TypeError, ValueError):
+      abort(400)
+
+    strict = bool(body.get('strict'))
+    try:
+      deleted_ids = Question.delete_all(criteria, ids if strict else None)
+    except LookupError:
+      abort(422)
+    if strict and not deleted_ids:
+      abort(422)
+
+    response = {
+      'success': True,
+      'deleted': len(deleted_ids)
+    }
+    if ids is not None:
+      response['not_found'] = sorted(set(ids) - set(deleted_ids))
+    return responder.response(response)
+
+
+  '''
+  PATCH '/questions'
+    - Updates many questions at once with a single statement, e.g. to move them to another category.
+    - Request Arguments: 'set', an object of the new values of 'question', 'answer', 'category' and/or 'difficulty',
+      and the questions to update as for DELETE '/questions': 'ids', 'category', 'difficulty' and optional 'strict'.
+    - Returns: An object with the keys
+      - 'updated' that is the number of updated questions
+      - 'not_found', only with 'ids', the ids that are not questions
+    - Error: 400, if there are neither 'ids' nor a filter, or 'set' has an unknown column or an invalid value.
+    - Error: 422, in 'strict' mode, if a question is missing, or if the new 'category' does not exist.
+  '''
+  @app.route('/questions', methods=['PATCH'])
+  def update_questions():
+    body = request.get_json(silent=True) or {}
+    try:
+      criteria, ids = question_criteria(body)
+      values = question_values(body.get('set'))
+    except (TypeError, ValueError):
+      abort(400)
+
+    strict = bool(body.get('strict'))
+    try:
+      updated_ids = Question.update_all(criteria, values, ids if strict else None)
+    except LookupError:
+      abort(422)
+    except:
+      db.session.rollback()
+      abort(422)
+    if strict and not updated_ids:
+      abort(422)
+
+    response = {
+      'success': True,
+      'updated': len(updated_ids)
+    }
+    if ids is not None:
+      response['not_found'] = sorted(set(ids) - set(updated_ids))
+    return responder.response(response)
+
+
   '''
   @TODO: 
   Create an endpoint to POST a new question, 
@@ -184,6 +694,9 @@ def create_app(test_config=None):
         "id": 5, 
         "question": "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"
       }
+    - With 'WRITE_BEHIND' enabled, the question is queued and committed with others in a batch shortly after.
+      The response is then '202 Accepted' with a 'ticket' and a 'Location' to GET its status from
+      (see GET '/add/<ticket>'). If the queue is full, the question is added at once as without it.
     - Error: 400, if the key of the request argument is wrong. e.g., 'questio'
   '''
   @app.route('/add', methods=['POST'])
@@ -191,21 +704,96 @@ def create_app(test_config=None):
     try:
       question = request.get_json()['question']
       answer = request.get_json()['answer']
-      category = request.get_json()['category']
-      difficulty = request.get_json()['difficulty']
-      
+      category = int(request.get_json()['category'])
+      difficulty = int(request.get_json()['difficulty'])
+
+      pending = None
+      if write_queue is not None:
+        pending = write_queue.submit({'question': question, 'answer': answer, 'category': category, 'difficulty': difficulty})
+      if pending is not None:
+        response = responder.response({
+          'success': True,
+          'ticket': pending.ticket,
+          'status': pending.status
+        }, 202)
+        response.headers['Location'] = f'/add/{pending.ticket}'
+        return response
+
       new_question = Question(question=question, answer=answer, category=category, difficulty=difficulty) 
       new_question.insert()
 
-      return jsonify({
+      return responder.response({
         'success': True,
         'question': new_question.format()
       })
 
     except:
       abort(400)
+
+  '''
+  GET '/add/<ticket>'
+    - Fetches the status of a question queued by POST '/add' with 'WRITE_BEHIND' enabled
+    - Returns: An object with the keys 'ticket' and 'status'
+      - 'status' is 'pending' with '202 Accepted' until the question is committed, then 'committed' with the 'question'.
+        Only then is the question durable, a worker that is killed before loses the questions it still has pending.
+    - Error: 404, if the ticket is unknown, expired, or was issued by another worker.
+    - Error: 422, with 'status' 'failed', if the question could not be inserted.
+  '''
+  @app.route('/add/<ticket>', methods=['GET'])
+  def get_added_question(ticket):
+    pending = write_queue.get(ticket) if write_queue is not None else None
+    if pending is None:
+      abort(404)
+
+    response = pending.format()
+    if response['status'] == 'failed':
+      response.update({
+        'success': False,
+        'error': 422,
+        'message': 'unprocessible'
+      })
+      return responder.response(response, 422)
+
+    response['success'] = True
+    return responder.response(response, 202 if response['status'] == 'pending' else 200)
     
 
+  '''
+  POST '/questions/import'
+    - Adds many questions at once, e.g. a question pack. The body is the file to import.
+    - Request Arguments: 'format' in the query string, 'jsonl', 'csv' or 'copy'.
+      Without it, the format follows the Content-Type: 'application/x-ndjson' for 'jsonl', 'text/csv' for 'csv'
+      and 'text/plain' for 'copy'.
+      - 'jsonl' has one JSON object per line with the keys of POST '/add'.
+      - 'csv' has a header line naming the columns: question, answer, category, difficulty.
+      - 'copy' is the text format of PostgreSQL COPY, like the questions in trivia.psql.
+      An 'id' column is ignored, the imported questions get new ids.
+    - Returns: An object with three keys,
+      - 'imported' that is the number of questions added
+      - 'errors' that is a list of the first 100 rejected lines, e.g. {"line": 3, "message": "'difficulty' must be from 1 to 5"}
+      - 'total_errors' that is the number of rejected lines
+      Rejected lines do not stop the import, all valid lines are added in a single transaction.
+    - Error: 400, if the format is unknown or the body is not UTF-8.
+  '''
+  @app.route('/questions/import', methods=['POST'])
+  def import_questions_file():
+    import_format = request.args.get('format', IMPORT_MIMETYPES.get(request.mimetype))
+    if import_format not in IMPORT_FORMATS:
+      abort(400)
+
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+      result = import_questions(lines, import_format, app.config['IMPORT_BATCH_SIZE'])
+    except UnicodeDecodeError:
+      abort(400)
+    except:
+      abort(422)
+
+    response = result.format()
+    response['success'] = True
+    return responder.response(response)
+
+
   '''
   @TODO: 
   Create a POST endpoint to get questions based on a search term. 
@@ -219,8 +807,22 @@ def create_app(test_config=None):
   '''
   POST '/questions'
     - Searches questions that include a 'searchTerm' 
-    - Request Arguments: searchTerm, a terminology to search.
-    - Returns: A list of objects, questions. e.g., if 'searchTerm' is 'name',
+    - Request Arguments: searchTerm, a terminology to search. 
+      Optional 'mode', 'fuzzy', 'limit', 'page', 'cursor', 'category' and 'difficulty'.
+      - 'mode' is 'substring', 'fulltext', 'fuzzy' or 'index', the 'SEARCH_MODE' of the app by default ('substring').
+        'substring' returns the questions that include the search term, the earlier it appears in the question the better. 
+        'fulltext' searches the words of the questions and answers, the most relevant first.
+        'fuzzy' tolerates typos, the most similar first.
+        'index' searches the words of the questions and answers in memory, the last word may be the beginning of a word.
+        It needs 'SEARCH_INDEX' enabled.
+      - 'fuzzy' set to true is the same as 'mode' 'fuzzy'.
+      - 'limit' is the number of questions of a page, 'SEARCH_RESULT_LIMIT' (10) by default and at most 'SEARCH_RESULT_MAX_LIMIT' (100),
+        and 'page' is the page of the matches.
+      - 'cursor' is an opaque string from 'next_cursor' of the previous response. An empty 'cursor' starts from the first match. 
+        With a cursor, the matches are returned one page at a time in the order of their ids together with 'next_cursor'.
+      - 'category' and 'difficulty' narrow the matches to a category id or a difficulty.
+    - Returns: An object with the keys
+      - 'questions' that contains a list of question objects. e.g., if 'searchTerm' is 'name',
       [
         {
           "answer": "Muhammad Ali",
@@ -237,26 +839,115 @@ def create_app(test_config=None):
           "question": "Which is the only team to play in every soccer World Cup tournament?"
         }
       ]
+      - 'total_questions' that is the number of matches in the selected category and difficulty
+      - 'facets' that contains the number of matches per 'category' within the selected difficulty 
+        and per 'difficulty' within the selected category
+        {
+          "category": {"4": 1, "6": 1},
+          "difficulty": {"1": 1, "3": 1}
+        }
+      - 'current_category' that is the selected category or 'None'
     - Error: 400, if the key of the request argument is wrong. e.g., 'searchterm'
   '''
   @app.route('/questions', methods=['POST'])
+  @read_only
   def search_questions():
     try:
-      search_term = request.get_json()['searchTerm']
-    
-      search_results = Question.query.filter(Question.question.ilike(f'%{search_term}%')).all()
+      body = request.get_json()
+      search_term = body['searchTerm']
+      mode = body.get('mode', app.config['SEARCH_MODE'])
+      if body.get('fuzzy') is True:
+        mode = 'fuzzy'
+      limit = int(body.get('limit', app.config['SEARCH_RESULT_LIMIT']))
+      page = int(body.get('page', 1))
+      cursor = body.get('cursor')
+      category = None if body.get('category') is None else int(body['category'])
+      difficulty = None if body.get('difficulty') is None else int(body['difficulty'])
+      response = {}
+
+      if not 0 < limit <= app.config['SEARCH_RESULT_MAX_LIMIT'] or page <= 0:
+        abort(400)
+
+      if mode == 'index':
+        if search_index is None:
+          abort(400)
+        search_index.refresh()
+        documents = search_index.documents
+        question_ids = search_index.search(search_term)
+        counts = Counter((documents[question_id]['category'], documents[question_id]['difficulty']) for question_id in question_ids)
+        total_questions, facets = search.summarize_facets(((key[0], key[1], count) for key, count in counts.items()), category, difficulty)
 
-      formatted_questions = [question.format() for question in search_results] 
+        question_ids = [
+          question_id for question_id in question_ids
+          if (category is None or documents[question_id]['category'] == category)
+          and (difficulty is None or documents[question_id]['difficulty'] == difficulty)
+        ]
+        if cursor is None:
+          question_ids = question_ids[(page - 1) * limit:page * limit]
+        else:
+          question_ids, response['next_cursor'] = seek_ids(sorted(question_ids), cursor, limit)
+        formatted_questions = [documents[question_id] for question_id in question_ids]
+
+      else:
+        counts = search.search_facets(Question.query, mode, search_term)
+        total_questions, facets = search.summarize_facets(counts, category, difficulty)
+
+        search_query = Question.query
+        if category is not None:
+          search_query = search_query.filter(Question.category == category)
+        if difficulty is not None:
+          search_query = search_query.filter(Question.difficulty == difficulty)
 
-      return jsonify({
+        if cursor is None:
+          formatted_questions = Question.format_all(search.search_questions(search_query, mode, search_term, limit, (page - 1) * limit))
+        else:
+          search_query = search_query.filter(search.SEARCH_MODES[mode].filter(search_term))
+          formatted_questions, response['next_cursor'] = seek_questions(search_query, cursor, limit=limit)
+
+      response.update({
         'success': True,
-        'questions': formatted_questions
+        'questions': formatted_questions,
+        'total_questions': total_questions,
+        'facets': facets,
+        'current_category': category
       })
 
+      return responder.questions_response(response, 'questions')
+
     except:
       abort(400)
 
 
+  '''
+  GET '/questions/suggest'
+    - Fetches completions for the search box while typing, the words of the questions and the answers
+    - Request Arguments: prefix, optional limit
+      - 'prefix' is what has been typed so far.
+      - 'limit' is the number of completions, 5 by default.
+    - Returns: An object with two keys,
+      - 'prefix' is the prefix of the request.
+      - 'suggestions' is a list of completions, the ones found in the most questions first. e.g., if 'prefix' is 'wh',
+        ["what", "which", "who", "whose"]
+    - Error: 400, if there is no 'prefix'
+  '''
+  @app.route('/questions/suggest', methods=['GET'])
+  @read_only
+  def suggest_questions():
+    prefix = request.args.get('prefix')
+    limit = request.args.get('limit', SUGGESTIONS_PER_PREFIX, type=int)
+
+    if prefix is None or limit <= 0:
+      abort(400)
+
+    suggester.refresh()
+
+    return responder.response({
+      'success': True,
+      'prefix': prefix,
+      'suggestions': suggester.suggest(prefix, limit)
+    })
+
+
   '''
   @TODO: 
   Create a GET endpoint to get questions based on category. 
@@ -268,7 +959,9 @@ def create_app(test_config=None):
   '''
   GET '/categories/<int:category_id>'
     - Fetches a list of questions and the number of total questions in the current category
-    - Request Arguments: None
+    - Request Arguments: None or 'cursor'
+      - 'cursor' is an opaque string from 'next_cursor' of the previous response. An empty 'cursor' starts from the first question. 
+        With a cursor, the questions are returned one page at a time, seeking on (category, id).
     - Returns: An object with three keys,
       - 'current_category' that is an id of the current category
       - 'questions' that contains a list of question objects
@@ -280,24 +973,46 @@ def create_app(test_config=None):
           "question": "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"
         }
       - 'total_questions' that is the number of total questions in the current category
+      - 'next_cursor', only if 'cursor' is given, that is the cursor of the next page or 'None' on the last page
     - Error: 404, there is no category of 'category_id' 
+    - Error: 400, if the 'cursor' is malformed or belongs to another category. 
+    - The response has a weak 'ETag' and a 'Last-Modified' of the last write to the questions or categories.
+      If the request sends either back in 'If-None-Match' or 'If-Modified-Since' and nothing has been written since,
+      the response is '304 Not Modified' without a body.
   '''
   @app.route('/categories/<int:category_id>', methods=['GET'])
+  @read_only
+  @conditional
   def get_categories(category_id):
-    result = Category.query.filter_by(id=category_id).one_or_none()
-  
-    if result is None:
-      abort(404)
-    else: 
-      questions = Question.query.filter_by(category=category_id).all()
-      formatted_questions = [question.format() for question in questions]
+    cursor = request.args.get('cursor')
+    response = {}
+
+    # a category created by another worker may not be cached yet
+    if category_id not in category_cache.get().types:
+      if Category.query.filter_by(id=category_id).one_or_none() is None:
+        abort(404)
+      category_cache.invalidate()
+
+    category_query = Question.query.filter_by(category=category_id)
+
+    if cursor is None:
+      formatted_questions = Question.format_all(category_query)
+      total_questions = len(formatted_questions)
+    else:
+      try:
+        formatted_questions, response['next_cursor'] = seek_questions(category_query, cursor, category_id)
+      except ValueError:
+        abort(400)
+      total_questions = QuestionCount.get(category_id)
  
-    return jsonify({
+    response.update({
       'success': True,
       'questions': formatted_questions,
-      'total_questions': len(formatted_questions),
+      'total_questions': total_questions,
       'current_category': category_id
     })
+
+    return responder.questions_response(response, 'questions')
   
 
   '''
@@ -332,50 +1047,221 @@ def create_app(test_config=None):
     - Error: 422, there is no question to play
   '''
   @app.route('/play', methods=['POST'])
+  @read_only
   def play_quizzes():
     try:
       category =  request.get_json()['quiz_category']['id']
       previous_questions = request.get_json()['previous_questions']
-      possible_questions = []
     
-      if category is 0:
-        all_questions = Question.query.all()
-      else:
-        all_questions = Question.query.filter_by(category=category).all()
-      
       # error, there is no question to play in a current category
-      if len(all_questions) <= 0:
+      if len(question_pool.ids(int(category))) <= 0:
         abort(422)
 
-      # make a pool of questions to play the quiz without already played questions
-      for question in all_questions:
-        if question.id in previous_questions:
-          pass
-        else:
-          possible_questions.append(question)
+      current_question = question_pool.next_question(int(category), previous_questions)
 
       # return 'False' for scoring if there is no possible question to play or a random question
-      if len(possible_questions) <= 0:
-        return jsonify({
+      if current_question is None:
+        return responder.response({
           'success': False,
           'previous_questions': previous_questions,
           'category': category,
           'question': None
         })
-      else:
-        current_question = possible_questions[random.randint(0, len(possible_questions)-1)].format()
 
-      return jsonify({
+      return responder.questions_response({
         'success': True,
         'previous_questions': previous_questions,
         'category': category,
         'question': current_question
-      })
+      }, 'question')
+
+    except:
+      abort(422)
+
+
+  '''
+  POST '/play/round'
+    - Fetches every question of a quiz round at once, instead of one '/play' request per question
+    - Request Arguments: quiz_category, optional questions_per_play, previous_questions and seed
+      - 'quiz_category' is the category of the questions to play the quiz in this time. 
+        If the value of 'quiz_category' is 0, it means 'All' categories.
+      - 'questions_per_play' is the number of questions of the round, 5 by default.
+      - 'previous_questions' are the questions already played.
+      - 'seed' is an integer. The same seed gives the same round as long as the questions do not change.
+    - Returns: An object with three keys,
+      - 'previous_questions' are the quesitons already played.
+      - 'category' is the category of the questions to play the quiz in this time.
+      - 'questions' is a list of distinct random questions that are not one of the previous questions.
+        It is shorter than 'questions_per_play' when there are not enough questions left, 
+        and 'success' is 'False' when it is empty.
+    - Error: 422, there is no question to play
+  '''
+  @app.route('/play/round', methods=['POST'])
+  @read_only
+  def play_round():
+    try:
+      category = request.get_json()['quiz_category']['id']
+      questions_per_play = int(request.get_json().get('questions_per_play', QUESTIONS_PER_PLAY))
+      previous_questions = request.get_json().get('previous_questions', [])
+      seed = request.get_json().get('seed')
+      rng = random if seed is None else random.Random(int(seed))
+
+      # error, there is no question to play in a current category
+      if len(question_pool.ids(int(category))) <= 0 or questions_per_play <= 0:
+        abort(422)
+
+      questions = question_pool.next_questions(int(category), questions_per_play, previous_questions, rng, ordered=seed is not None)
+
+      return responder.questions_response({
+        'success': len(questions) > 0,
+        'previous_questions': previous_questions,
+        'category': category,
+        'questions': questions
+      }, 'questions')
 
     except:
       abort(422)
 
+
+  '''
+  POST '/quizzes'
+    - Starts a quiz session. The questions of the category are shuffled once and kept on the server as a deck,
+      so the client does not send 'previous_questions' for every question.
+    - Request Arguments: quiz_category, optional questions_per_play
+      - 'quiz_category' is the category of the questions to play the quiz in this time. 
+        If the value of 'quiz_category' is 0, it means 'All' categories.
+      - 'questions_per_play' is the number of questions to play. None means every question of the category.
+    - Returns: An object with the key 'quiz' 
+        {
+          "id": "mSgNkmhOM7j2Ah8vrLhFYg",
+          "category": 6,
+          "played": 0,
+          "remaining": 2
+        }
+    - Error: 422, there is no question to play, or 'questions_per_play' is not a positive number
+  '''
+  @app.route('/quizzes', methods=['POST'])
+  def start_quiz():
+    try:
+      category = int(request.get_json()['quiz_category']['id'])
+      questions_per_play = request.get_json().get('questions_per_play')
+      if questions_per_play is not None:
+        questions_per_play = int(questions_per_play)
+        if questions_per_play <= 0:
+          abort(422)
+    except:
+      abort(422)
+
+    deck = shuffled_deck(question_pool, category, questions_per_play)
+
+    # error, there is no question to play in a current category
+    if len(deck) <= 0:
+      abort(422)
+
+    quiz_id = new_session_id()
+    quiz_sessions.create(quiz_id, category, deck)
+
+    return responder.response({
+      'success': True,
+      'quiz': quiz_sessions.get(quiz_id)
+    })
+
+
+  '''
+  POST '/quizzes/<quiz_id>/next'
+    - Fetches the next question of a quiz session
+    - Request Arguments: None
+    - Returns: An object with two keys,
+      - 'quiz' is the quiz session with the number of 'played' and 'remaining' questions.
+      - 'question' is the next question to play, or 'None' with 'success' 'False' when the deck is empty. 
+        {
+          "answer": "Maya Angelou", 
+          "category": 4, 
+          "difficulty": 2, 
+          "id": 5, 
+          "question": "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"
+        } 
+    - Error: 404, there is no quiz session of 'quiz_id' or it has expired
+  '''
+  @app.route('/quizzes/<quiz_id>/next', methods=['POST'])
+  def next_quiz_question(quiz_id):
+    try:
+      current_question = None
+      while current_question is None:
+        question_id = quiz_sessions.pop(quiz_id)
+        if question_id is None:
+          break
+        # a question deleted after the deck was shuffled is skipped
+        current_question = next(iter(Question.format_all(Question.query.filter_by(id=question_id))), None)
+      quiz = quiz_sessions.get(quiz_id)
+    except KeyError:
+      abort(404)
+
+    return responder.questions_response({
+      'success': current_question is not None,
+      'quiz': quiz,
+      'question': current_question
+    }, 'question')
+
+
+  '''
+  DELETE '/quizzes/<quiz_id>'
+    - Ends a quiz session
+    - Request Arguments: None
+    - Returns: An object with the key 'deleted' that is the id of the quiz session
+    - Error: 404, there is no quiz session of 'quiz_id' or it has expired
+  '''
+  @app.route('/quizzes/<quiz_id>', methods=['DELETE'])
+  def end_quiz(quiz_id):
+    try:
+      quiz_sessions.delete(quiz_id)
+    except KeyError:
+      abort(404)
+
+    return responder.response({
+      'success': True,
+      'deleted': quiz_id
+    })
+
     
+  '''
+  GET '/metrics'
+    - Fetches the metrics of the app in the Prometheus text format, for a Prometheus server to scrape
+    - Returns: for every route and method,
+      - 'trivia_http_requests_total', the requests answered, also by status
+      - 'trivia_http_request_duration_seconds', a histogram of the time to answer them
+      - 'trivia_db_duration_seconds' and 'trivia_json_encode_duration_seconds', histograms of the time per request
+        spent running SQL statements and encoding JSON
+      With 'METRICS_DIR' set, the metrics are the sum of every worker that shares that directory,
+      otherwise they are those of the worker that answers.
+  '''
+  @app.route('/metrics', methods=['GET'])
+  def get_metrics():
+    return app.response_class(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+  '''
+  GET '/metrics/pool'
+    - Fetches the state of the database connection pool of the worker that answers, its process id is 'pid'.
+    - Returns: An object with the keys 'pid' and 'pool',
+      - 'size', 'in_use', 'idle' and 'overflow', the connections of the pool now
+      - 'checkouts', 'checkins', 'connects', 'closes' and 'invalidations' since the worker started
+      - 'checkout_wait', how long requests waited for a connection: 'count', 'mean_ms', 'max_ms', 'total_ms'
+        and 'timeouts', the checkouts that gave up after 'DB_POOL_TIMEOUT'
+    - Error: 404, if the pool is not instrumented, e.g. with SQLite.
+  '''
+  @app.route('/metrics/pool', methods=['GET'])
+  def get_pool_metrics():
+    pool = db.get_engine(app).pool
+    stats = getattr(pool, 'stats', None)
+    if stats is None:
+      abort(404)
+
+    return responder.response({
+      'success': True,
+      'pid': os.getpid(),
+      'pool': stats.format(pool)
+    })
+
   '''
   @TODO: 
   Create error handlers for all expected errors 
@@ -383,42 +1269,42 @@ def create_app(test_config=None):
   '''
   @app.errorhandler(400)
   def bad_request(error):
-    return jsonify({
+    return responder.response({
       "success": False,
       "error": 400,
       "message": "bad request"
-    }), 400
+    }, 400)
 
   @app.errorhandler(404)
   def not_found(error):
-    return jsonify({
+    return responder.response({
       "success": False,
       "error": 404,
       "message": "resource not found"
-    }), 404
+    }, 404)
 
   @app.errorhandler(405)
   def mehotd_not_allowed(error):
-    return jsonify({
+    return responder.response({
       "success": False,
       "error": 405,
       "message": "method not allowed"
-    }), 405
+    }, 405)
 
   @app.errorhandler(422)
   def unprocessible(error):
-    return jsonify({
+    return responder.response({
       "success": False,
       "error": 422,
       "message": "unprocessible"
-    }), 422
+    }, 422)
 
   @app.errorhandler(500)
   def internal_server_error(error):
-    return jsonify({
+    return responder.response({
       "success": False,
       "error": 500,
       "message": "internal server error"
-    }), 422
+    }, 422)
  
   return app  
\ No newline at end of file
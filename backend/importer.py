@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from sqlalchemy import func
+
+from models import db, notify_change, Question, Category, QuestionCount
+
+IMPORT_FORMATS = ('jsonl', 'csv', 'copy')
+IMPORT_BATCH_SIZE = 1000
+# the columns of the COPY block of questions in trivia.psql, for a block without its COPY header
+COPY_COLUMNS = ('id', 'question', 'answer', 'difficulty', 'category')
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+# an import of more questions reloads the caches, which is cheaper than telling them about every question
+NOTIFY_QUESTION_LIMIT = 1000
+
+'''
+read_jsonl(lines) / read_csv(lines) / read_copy(lines)
+    turn the lines of an import file into (line_number, record) pairs, one record per question,
+    reading one line at a time so that a file of any size is never held in memory.
+    A record is a dict of the question fields, or a ValueError if the line cannot be parsed.
+    'read_copy' reads the text format of PostgreSQL COPY: tab separated, \\N for NULL and backslash escapes.
+    It takes a bare block of questions, or a whole dump like trivia.psql, of which it reads only
+    the 'COPY public.questions (...) FROM stdin;' block and skips the SQL and the blocks of other tables.
+'''
+def read_jsonl(lines):
+  for line_number, line in enumerate(lines, 1):
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+      if not isinstance(record, dict):
+        raise ValueError('a line must be a JSON object')
+    except ValueError as error:
+      record = ValueError(f'invalid JSON: {error}')
+    yield line_number, record
+
+def read_csv(lines):
+  reader = csv.DictReader(lines)
+  for record in reader:
+    if None in record:
+      record = ValueError('more values than columns')
+    yield reader.line_num, record
+
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+
+def unescape_copy(value):
+  if value == '\\N':
+    return None
+  if '\\' not in value:
+    return value
+
+  characters = []
+  escaped = False
+  for character in value:
+    if escaped:
+      characters.append(COPY_ESCAPES.get(character, character))
+      escaped = False
+    elif character == '\\':
+      escaped = True
+    else:
+      characters.append(character)
+  return ''.join(characters)
+
+COPY_TABLES = ('questions', 'public.questions')
+
+def read_copy(lines):
+  columns = None
+  skipping = False
+  for line_number, line in enumerate(lines, 1):
+    line = line.rstrip('\r\n')
+    if skipping:
+      # the block of another table, up to its own end
+      skipping = line != '\\.'
+      continue
+    if columns is None:
+      if line.startswith('COPY '):
+        if line.split()[1] not in COPY_TABLES:
+          skipping = True
+          continue
+        try:
+          columns = tuple(column.strip() for column in line[line.index('(') + 1:line.index(')')].split(','))
+        except ValueError:
+          yield line_number, ValueError('the COPY line has no column list')
+          return
+        continue
+      if not line or line.startswith('--') or line.endswith(';') or '\t' not in line:
+        # the SQL of a dump around its COPY blocks
+        continue
+      # a block without its COPY line
+      columns = COPY_COLUMNS
+
+    if not line:
+      continue
+    if line == '\\.':
+      break
+
+    values = line.split('\t')
+    if len(values) != len(columns):
+      yield line_number, ValueError(f'{len(values)} values for {len(columns)} columns')
+    else:
+      yield line_number, dict(zip(columns, (unescape_copy(value) for value in values)))
+
+IMPORT_READERS = {
+  'jsonl': read_jsonl,
+  'csv': read_csv,
+  'copy': read_copy,
+}
+
+'''
+validate_question(record, category_ids)
+    the (question, answer, category, difficulty) of a record, or ValueError naming what is wrong with it.
+    Question and answer must not be blank, the category must exist and the difficulty must be 1 to 5.
+    An 'id' in the record is ignored, imported questions get new ids.
+'''
+def validate_question(record, category_ids):
+  fields = []
+  for field in ('question', 'answer'):
+    value = record.get(field)
+    if not isinstance(value, str) or not value.strip():
+      raise ValueError(f"'{field}' is missing or blank")
+    fields.append(value)
+
+  try:
+    category = int(record.get('category'))
+  except (TypeError, ValueError):
+    raise ValueError("'category' is not an integer")
+  if category not in category_ids:
+    raise ValueError(f"there is no category {category}")
+
+  try:
+    difficulty = int(record.get('difficulty'))
+  except (TypeError, ValueError):
+    raise ValueError("'difficulty' is not an integer")
+  if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+    raise ValueError(f"'difficulty' must be from {MIN_DIFFICULTY} to {MAX_DIFFICULTY}")
+
+  return fields[0], fields[1], category, difficulty
+
+'''
+ImportResult
+    the number of questions imported, and the line and message of every rejected record.
+    Only the first 'error_limit' errors are kept, all of them if it is None. 'total_errors' counts all of them.
+'''
+class ImportResult:
+
+  def __init__(self, error_limit=100):
+    self.imported = 0
+    self.errors = []
+    self.total_errors = 0
+    self.error_limit = error_limit
+
+  def reject(self, line_number, message):
+    self.total_errors += 1
+    if self.error_limit is None or len(self.errors) < self.error_limit:
+      self.errors.append({'line': line_number, 'message': str(message)})
+
+  def format(self):
+    return {
+      'imported': self.imported,
+      'errors': self.errors,
+      'total_errors': self.total_errors
+    }
+
+'''
+import_questions(lines, import_format, batch_size, error_limit)
+    validates the records of an import file while reading it, and loads the valid questions in batches
+    of 'batch_size', through COPY on PostgreSQL and a batched executemany INSERT otherwise.
+    Invalid records are reported in the result and skipped, they do not abort the import.
+    Every batch and the question counts are written in a single transaction, so the import is applied
+    as a whole or, if the database fails, not at all. The caches are told about every new question at the end,
+    or reloaded once if there are more than NOTIFY_QUESTION_LIMIT.
+'''
+def import_questions(lines, import_format='jsonl', batch_size=IMPORT_BATCH_SIZE, error_limit=100):
+  records = IMPORT_READERS[import_format](lines)
+  category_ids = {category_id for category_id, in db.session.query(Category.id)}
+  result = ImportResult(error_limit)
+  counts = Counter()
+  batch = []
+
+  connection = db.session.connection()
+  load_batch = copy_batch if connection.dialect.name == 'postgresql' else insert_batch
+  # the sequence only grows, so every imported question gets an id above the last one now
+  last_id = db.session.query(func.max(Question.id)).scalar() or 0
+
+  try:
+    for line_number, record in records:
+      try:
+        if isinstance(record, ValueError):
+          raise record
+        row = validate_question(record, category_ids)
+      except ValueError as error:
+        result.reject(line_number, error)
+        continue
+
+      batch.append(row)
+      counts[row[2]] += 1
+      if len(batch) >= batch_size:
+        load_batch(connection, batch)
+        result.imported += len(batch)
+        batch = []
+
+    if batch:
+      load_batch(connection, batch)
+      result.imported += len(batch)
+
+    for category, total in counts.items():
+      QuestionCount.bump(category, total)
+    db.session.commit()
+  except:
+    db.session.rollback()
+    raise
+
+  if result.imported > NOTIFY_QUESTION_LIMIT:
+    notify_change(Question, 'reload')
+  elif result.imported:
+    # questions added meanwhile by other requests may be among them, telling the listeners twice is harmless
+    for question in Question.query.filter(Question.id > last_id):
+      notify_change(Question, 'insert', question)
+  return result
+
+COPY_SQL = 'COPY public.questions (question, answer, category, difficulty) FROM STDIN'
+
+def escape_copy(value):
+  return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_batch(connection, batch):
+  buffer = io.StringIO()
+  for row in batch:
+    buffer.write('\t'.join(escape_copy(value) for value in row))
+    buffer.write('\n')
+  buffer.seek(0)
+
+  # the DBAPI connection of the session's transaction, so the COPY commits or rolls back with it
+  with connection.connection.cursor() as cursor:
+    cursor.copy_expert(COPY_SQL, buffer)
+
+def insert_batch(connection, batch):
+  connection.execute(Question.__table__.insert(), [
+    {'question': question, 'answer': answer, 'category': category, 'difficulty': difficulty}
+    for question, answer, category, difficulty in batch
+  ])
@@ -0,0 +1,302 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import secrets
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_app_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+'''
+PoolStats
+    counts what a connection pool of this worker does: checkouts and checkins, new, closed and invalidated
+    connections (the churn, e.g. after recycling or a failover), and how long checkouts waited for a free
+    connection, including the ones that gave up after the pool timeout.
+'''
+class PoolStats:
+
+  EVENTS = {
+    'connect': 'connects',
+    'close': 'closes',
+    'invalidate': 'invalidations',
+    'soft_invalidate': 'invalidations',
+    'checkout': 'checkouts',
+    'checkin': 'checkins',
+  }
+
+  def __init__(self):
+    self.counts = dict.fromkeys(self.EVENTS.values(), 0)
+    self.waits = 0
+    self.wait_total = 0.0
+    self.wait_max = 0.0
+    self.timeouts = 0
+    self._lock = threading.Lock()
+
+  def listen(self, pool):
+    for name, counter in self.EVENTS.items():
+      event.listen(pool, name, self._counter(counter))
+
+  def _counter(self, counter):
+    def count(*args):
+      with self._lock:
+        self.counts[counter] += 1
+    return count
+
+  def record_wait(self, seconds, timed_out=False):
+    with self._lock:
+      self.waits += 1
+      self.wait_total += seconds
+      self.wait_max = max(self.wait_max, seconds)
+      if timed_out:
+        self.timeouts += 1
+
+  def format(self, pool):
+    with self._lock:
+      formatted = dict(self.counts)
+      formatted.update({
+        'size': pool.size(),
+        'in_use': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'checkout_wait': {
+          'count': self.waits,
+          'mean_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+          'max_ms': round(self.wait_max * 1000, 3),
+          'total_ms': round(self.wait_total * 1000, 3),
+          'timeouts': self.timeouts
+        }
+      })
+    return formatted
+
+'''
+InstrumentedQueuePool
+    the default QueuePool of SQLAlchemy, timing every checkout in its PoolStats 'stats'.
+    The stats survive recreate(), which SQLAlchemy calls when the engine is disposed.
+'''
+class InstrumentedQueuePool(QueuePool):
+
+  def __init__(self, creator, **kwargs):
+    super().__init__(creator, **kwargs)
+    self.stats = PoolStats()
+    # a recreated pool copies the listeners of the pool it replaces, recreate() hands it their stats
+    if '_dispatch' not in kwargs:
+      self.stats.listen(self)
+
+  def recreate(self):
+    pool = super().recreate()
+    pool.stats = self.stats
+    return pool
+
+  def _do_get(self):
+    start = time.perf_counter()
+    try:
+      connection = super()._do_get()
+    except exc.TimeoutError:
+      self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+      raise
+    self.stats.record_wait(time.perf_counter() - start)
+    return connection
+
+'''
+instrument_queries()
+    counts the SQL statements run by every engine of the process and the time they took, per request:
+    g.sql_queries and g.sql_time in seconds. The listeners are installed once per process.
+'''
+def instrument_queries():
+  if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', discard_query_start)
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+  connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+  elapsed = time.perf_counter() - connection.info['query_start'].pop()
+  if has_app_context():
+    g.sql_queries = g.get('sql_queries', 0) + 1
+    g.sql_time = g.get('sql_time', 0.0) + elapsed
+
+def discard_query_start(context):
+  # a failed statement never reaches after_cursor_execute
+  if context.connection is not None and context.connection.info.get('query_start'):
+    context.connection.info['query_start'].pop()
+
+'''
+Histogram(buckets)
+    a Prometheus histogram with fixed bucket bounds: observing a value is a binary search and an increment.
+    counts[i] is the number of values not above buckets[i] and above the previous bound, the last count
+    is the values above every bound. They are made cumulative only when rendered.
+'''
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+
+  def __init__(self, buckets=LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+
+  def observe(self, value):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+
+  def merge(self, counts, total):
+    for i, count in enumerate(counts):
+      self.counts[i] += count
+    self.sum += total
+
+'''
+RequestMetrics(directory, flush_interval)
+    the requests answered by this worker by route, method and status, and histograms per route and method
+    of their latency, of the time spent in SQL statements and of the time spent encoding JSON.
+
+    With a 'directory', every worker also writes its metrics to a file of its own in it, from a background
+    thread every 'flush_interval' seconds while it has new requests and when it exits, and render() sums
+    the files of all workers, so that any worker answers for all of them. Files of workers that have exited
+    stay and keep counting in the totals, so counters never go backwards. Empty the directory when the app
+    is deployed.
+'''
+HISTOGRAMS = (
+  ('trivia_http_request_duration_seconds', 'Time to answer a request, by route and method.'),
+  ('trivia_db_duration_seconds', 'Time spent running SQL statements per request, by route and method.'),
+  ('trivia_json_encode_duration_seconds', 'Time spent encoding JSON per request, by route and method.'),
+)
+
+class RequestMetrics:
+
+  def __init__(self, directory=None, flush_interval=1.0, buckets=LATENCY_BUCKETS):
+    self.directory = directory
+    self.flush_interval = flush_interval
+    self.buckets = buckets
+    self.requests = Counter()
+    self.histograms = {name: {} for name, _ in HISTOGRAMS}
+    self._dirty = False
+    self._path = None
+    self._pid = None
+    self._thread_pid = None
+    self._lock = threading.Lock()
+    self._flush_lock = threading.Lock()
+    if directory is not None:
+      atexit.register(self.close)
+
+  def observe(self, route, method, status, duration, db_time, encode_time):
+    key = (route, method)
+    with self._lock:
+      self.requests[(route, method, status)] += 1
+      for (name, _), value in zip(HISTOGRAMS, (duration, db_time, encode_time)):
+        histogram = self.histograms[name].get(key)
+        if histogram is None:
+          histogram = self.histograms[name][key] = Histogram(self.buckets)
+        histogram.observe(value)
+      self._dirty = True
+
+      # threads do not survive a fork, every worker starts its own flusher
+      if self.directory is not None and self._thread_pid != os.getpid():
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+  def _run(self):
+    while True:
+      time.sleep(self.flush_interval)
+      if self._dirty:
+        self.flush()
+
+  def snapshot(self):
+    with self._lock:
+      self._dirty = False
+      return {
+        'requests': [[route, method, status, count] for (route, method, status), count in self.requests.items()],
+        'histograms': {
+          name: [[route, method, histogram.counts, histogram.sum] for (route, method), histogram in histograms.items()]
+          for name, histograms in self.histograms.items()
+        }
+      }
+
+  def flush(self):
+    with self._flush_lock:
+      # a forked worker has a new pid, and a pid may be reused by a later worker, so the file also has a random part
+      if self._pid != os.getpid():
+        self._pid = os.getpid()
+        self._path = os.path.join(self.directory, f'metrics-{self._pid}-{secrets.token_hex(4)}.json')
+
+      snapshot = self.snapshot()
+      temporary = self._path + '.tmp'
+      with open(temporary, 'w') as file:
+        json.dump(snapshot, file)
+      os.replace(temporary, self._path)
+
+  def close(self):
+    # the last requests of an exiting worker, if its directory is still there
+    if self._dirty:
+      try:
+        self.flush()
+      except OSError:
+        pass
+
+  def collect(self):
+    '''
+    the sum of the snapshots of every worker, or of this one without a directory
+    '''
+    if self.directory is None:
+      snapshots = [self.snapshot()]
+    else:
+      self.flush()
+      snapshots = []
+      for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+        try:
+          with open(path) as file:
+            snapshots.append(json.load(file))
+        except (OSError, ValueError):
+          # a worker replaced its file while it was read, its next flush is counted next time
+          continue
+
+    requests = Counter()
+    histograms = {name: {} for name, _ in HISTOGRAMS}
+    for snapshot in snapshots:
+      for route, method, status, count in snapshot['requests']:
+        requests[(route, method, status)] += count
+      for name, rows in snapshot['histograms'].items():
+        for route, method, counts, total in rows:
+          histogram = histograms[name].get((route, method))
+          if histogram is None:
+            histogram = histograms[name][(route, method)] = Histogram(self.buckets)
+          histogram.merge(counts, total)
+    return requests, histograms
+
+  def render(self):
+    '''
+    the metrics in the Prometheus text exposition format
+    '''
+    requests, histograms = self.collect()
+    lines = [
+      '# HELP trivia_http_requests_total Requests answered, by route, method and status.',
+      '# TYPE trivia_http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+      lines.append(f'trivia_http_requests_total{{{labels(route=route, method=method, status=status)}}} {count}')
+
+    for name, description in HISTOGRAMS:
+      lines.append(f'# HELP {name} {description}')
+      lines.append(f'# TYPE {name} histogram')
+      for (route, method), histogram in sorted(histograms[name].items()):
+        route_labels = labels(route=route, method=method)
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+          cumulative += count
+          le = '+Inf' if bound == float('inf') else repr(bound)
+          lines.append(f'{name}_bucket{{{route_labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{route_labels}}} {histogram.sum!r}')
+        lines.append(f'{name}_count{{{route_labels}}} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+def labels(**values):
+  return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                  for key, value in values.items())
@@ -0,0 +1,23 @@
+'''
+The categories and questions tables of trivia.psql, for a database that was not restored from it.
+'''
+
+from sqlalchemy import text
+
+SQL = '''
+CREATE TABLE IF NOT EXISTS public.categories (
+    id serial PRIMARY KEY,
+    type text
+);
+
+CREATE TABLE IF NOT EXISTS public.questions (
+    id serial PRIMARY KEY,
+    question text,
+    answer text,
+    difficulty integer,
+    category integer
+);
+'''
+
+def upgrade(connection):
+  connection.execute(text(SQL))
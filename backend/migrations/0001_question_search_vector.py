@@ -0,0 +1,34 @@
+'''
+Full-text search over questions and answers, used by POST /questions with 'mode' 'fulltext'.
+Adds a tsvector column kept current by a trigger, fills it for the existing questions and indexes it with GIN.
+'''
+
+from sqlalchemy import text
+
+SQL = '''
+ALTER TABLE public.questions ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION public.questions_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('english', coalesce(NEW.question, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(NEW.answer, '')), 'B');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_search_vector_update ON public.questions;
+
+CREATE TRIGGER questions_search_vector_update
+  BEFORE INSERT OR UPDATE OF question, answer ON public.questions
+  FOR EACH ROW EXECUTE PROCEDURE public.questions_search_vector_update();
+
+UPDATE public.questions SET search_vector =
+  setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+  setweight(to_tsvector('english', coalesce(answer, '')), 'B');
+
+CREATE INDEX IF NOT EXISTS ix_questions_search_vector ON public.questions USING gin (search_vector);
+'''
+
+def upgrade(connection):
+  connection.execute(text(SQL))
@@ -0,0 +1,34 @@
+'''
+Trigram indexes on questions and answers.
+They turn the ILIKE '%term%' of the 'substring' search into index scans
+and serve the typo-tolerant similarity matches of the 'fuzzy' search of POST /questions.
+Where the pg_trgm extension is not available, e.g. on a managed PostgreSQL that does not offer it
+or does not let this user create it, the indexes are left out and only the 'fuzzy' search is unavailable.
+'''
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+EXTENSION_SQL = 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+
+SQL = '''
+CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON public.questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm ON public.questions USING gin (answer gin_trgm_ops);
+'''
+
+def upgrade(connection):
+  if not create_extension(connection):
+    return 'skipped, the pg_trgm extension is not available'
+  connection.execute(text(SQL))
+
+def create_extension(connection):
+  # in a savepoint, so that a failure leaves the transaction of the migration usable
+  savepoint = connection.begin_nested()
+  try:
+    connection.execute(text(EXTENSION_SQL))
+  except DBAPIError:
+    savepoint.rollback()
+    return False
+  savepoint.commit()
+  return True
@@ -0,0 +1,30 @@
+'''
+questions.category is an integer referencing categories.id, as in trivia.psql.
+Databases created by an earlier version of models.py have it as a string, this converts it.
+Adds the (category, id) and (category, difficulty) indexes of the per-category listings and quizzes.
+'''
+
+from sqlalchemy import text
+
+SQL = '''
+ALTER TABLE public.questions ALTER COLUMN category TYPE integer USING category::integer;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'public.questions'::regclass AND contype = 'f'
+  ) THEN
+    ALTER TABLE public.questions
+      ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+  END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON public.questions (category, id);
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_difficulty ON public.questions (category, difficulty);
+'''
+
+def upgrade(connection):
+  connection.execute(text(SQL))
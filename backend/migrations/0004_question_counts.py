@@ -0,0 +1,16 @@
+'''
+The number of questions per category and in total (category 0), kept by models.QuestionCount.
+Counts are filled on their first read, or by 'flask recount-questions'.
+'''
+
+from sqlalchemy import text
+
+SQL = '''
+CREATE TABLE IF NOT EXISTS public.question_counts (
+    category integer PRIMARY KEY,
+    total integer NOT NULL DEFAULT 0
+);
+'''
+
+def upgrade(connection):
+  connection.execute(text(SQL))
@@ -0,0 +1,38 @@
+'''
+A single-row data_version table, bumped by a trigger on every statement that writes questions or categories,
+so that the list endpoints can answer conditional GETs with one primary key lookup (models.DataVersion).
+'''
+
+from sqlalchemy import text
+
+SQL = '''
+CREATE TABLE IF NOT EXISTS public.data_version (
+    id integer PRIMARY KEY CHECK (id = 1),
+    version bigint NOT NULL DEFAULT 1,
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.data_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION public.bump_data_version() RETURNS trigger AS $$
+BEGIN
+  UPDATE public.data_version SET version = version + 1, updated_at = now() WHERE id = 1;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_data_version ON public.questions;
+
+CREATE TRIGGER questions_data_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.questions
+  FOR EACH STATEMENT EXECUTE PROCEDURE public.bump_data_version();
+
+DROP TRIGGER IF EXISTS categories_data_version ON public.categories;
+
+CREATE TRIGGER categories_data_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.categories
+  FOR EACH STATEMENT EXECUTE PROCEDURE public.bump_data_version();
+'''
+
+def upgrade(connection):
+  connection.execute(text(SQL))
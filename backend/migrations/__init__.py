@@ -0,0 +1,67 @@
+import importlib
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+'''
+Schema migrations
+    every module of this package named <number>_<name>.py is a migration with an upgrade(connection) function,
+    which may return a note on what it did, e.g. a step it skipped.
+    The numbers of the applied migrations are stored in the schema_version table.
+    upgrade() applies the missing ones in order, each in its own transaction.
+'''
+MIGRATION_PATTERN = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+CREATE_SCHEMA_VERSION = '''
+CREATE TABLE IF NOT EXISTS schema_version (
+    version integer PRIMARY KEY,
+    name text NOT NULL,
+    applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+'''
+
+def migrations():
+  '''
+  returns (version, name) of every migration, in order
+  '''
+  found = []
+  for filename in os.listdir(os.path.dirname(__file__)):
+    match = MIGRATION_PATTERN.match(filename)
+    if match:
+      found.append((int(match.group(1)), match.group(1) + '_' + match.group(2)))
+  return sorted(found)
+
+def latest_version():
+  return migrations()[-1][0]
+
+def current_version(connection):
+  '''
+  returns the version of the database, or None if no migration has been applied through this package
+  '''
+  try:
+    return connection.execute(text('SELECT max(version) FROM schema_version')).scalar()
+  except DBAPIError:
+    return None
+
+def upgrade(engine, echo=print):
+  '''
+  applies the migrations the database is missing and returns its new version
+  '''
+  with engine.begin() as connection:
+    connection.execute(text(CREATE_SCHEMA_VERSION))
+    version = current_version(connection)
+
+  for number, name in migrations():
+    if version is not None and number <= version:
+      continue
+
+    module = importlib.import_module(f'{__name__}.{name}')
+    with engine.begin() as connection:
+      note = module.upgrade(connection)
+      connection.execute(text('INSERT INTO schema_version (version, name) VALUES (:version, :name)'), version=number, name=name)
+    echo(f'Applied {name}, {note}' if note else f'Applied {name}')
+    version = number
+
+  return version
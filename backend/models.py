@@ -1,24 +1,145 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey, Index, create_engine, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.expression import Delete
 import json
+from collections import Counter
+
+import migrations
+from metrics import InstrumentedQueuePool
+from routing import RoutingSQLAlchemy, REPLICA_BIND_PREFIX
 
 # configuration to access database. ID: rhee, Password: projectpassword
 database_name = "trivia"
-database_path = "postgres://{}:{}@{}/{}".format('rhee','projectpassword','localhost:5432', database_name)
+database_path = os.environ.get("DATABASE_URL", "postgres://{}:{}@{}/{}".format('rhee','projectpassword','localhost:5432', database_name))
+
+db = RoutingSQLAlchemy()
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
 
-db = SQLAlchemy()
+POOL_SETTINGS = (
+    # config key and environment variable, engine option, type, default
+    ('DB_POOL_SIZE', 'pool_size', int, 5),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int, 10),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', float, 30),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int, 1800),
+    ('DB_POOL_PRE_PING', 'pool_pre_ping', parse_bool, True),
+)
+
+'''
+pool_options(config)
+    the engine options of the connection pool, each from the app config, else the environment variable
+    of the same name, else its default. Connections are pinged before use and recycled after 30 minutes,
+    so that connections broken by a Postgres failover or an idle timeout are replaced instead of failing a request.
+'''
+def pool_options(config):
+    options = {'poolclass': InstrumentedQueuePool}
+    for key, option, cast, default in POOL_SETTINGS:
+        value = config.get(key, os.environ.get(key))
+        options[option] = default if value is None else cast(value)
+    return options
+
+'''
+replica_urls(config)
+    the URLs of the read replicas, a list in the app config or a comma separated environment variable,
+    both named 'DATABASE_REPLICA_URLS'
+'''
+def replica_urls(config):
+    urls = config.get('DATABASE_REPLICA_URLS', os.environ.get('DATABASE_REPLICA_URLS', ''))
+    if isinstance(urls, str):
+        urls = urls.split(',')
+    return [url.strip() for url in urls if url.strip()]
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.
+    The schema is not created here, run 'flask db upgrade' to create or migrate it.
+    Before the first request, the version of the database is checked, then its tables and indexes against the models.
+    The pool is configured by pool_options(), 'SQLALCHEMY_ENGINE_OPTIONS' in the app config override it.
+    SQLite keeps the pool of Flask-SQLAlchemy.
+    Every replica URL becomes a bind named 'replica0', 'replica1', ... for the read-only endpoints.
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    binds = {name: url for name, url in (app.config.get("SQLALCHEMY_BINDS") or {}).items() if not name.startswith(REPLICA_BIND_PREFIX)}
+    for number, url in enumerate(replica_urls(app.config)):
+        binds[f'{REPLICA_BIND_PREFIX}{number}'] = url
+    app.config["SQLALCHEMY_BINDS"] = binds
+    if not database_path.startswith('sqlite'):
+        options = pool_options(app.config)
+        options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if app.config.get("SCHEMA_CHECK", True):
+        app.before_first_request(check_schema_version)
+        app.before_first_request(check_schema)
+
+'''
+check_schema_version()
+    raises RuntimeError if the database has not been migrated to the latest migration,
+    so that the app does not serve requests against an outdated schema
+'''
+def check_schema_version():
+    with db.engine.connect() as connection:
+        version = migrations.current_version(connection)
+
+    if version is None or version < migrations.latest_version():
+        raise RuntimeError(f'the database is at schema version {version}, run "flask db upgrade" to migrate it to {migrations.latest_version()}')
+
+'''
+check_schema()
+    compares the columns and indexes of the models with the live database and raises RuntimeError
+    if they disagree, e.g. a questions.category that is still a string or a missing index.
+    It inspects every table, so it runs once per worker before the first request,
+    and 'flask db upgrade' and 'flask db check' run it.
+'''
+def check_schema():
+    inspector = inspect(db.engine)
+    problems = []
+
+    for table in db.metadata.sorted_tables:
+        live_columns = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            live_column = live_columns.get(column.name)
+            if live_column is None:
+                problems.append(f'{table.name}.{column.name} is missing')
+            elif live_column['type']._type_affinity is not column.type._type_affinity:
+                problems.append(f'{table.name}.{column.name} is {live_column["type"]}, the model expects {column.type}')
+
+        live_indexes = {tuple(index['column_names']) for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if tuple(column.name for column in index.columns) not in live_indexes:
+                problems.append(f'index {index.name} on {table.name} is missing')
+
+    if problems:
+        raise RuntimeError('the database schema does not match the models: ' + '; '.join(problems))
+
+'''
+on_change(app, name, listener)
+    registers listener(model, action, instance) of 'app' under 'name', replacing an earlier listener of the same name.
+    Listeners are called after a write is committed. 'action' is 'insert', 'update' or 'delete',
+    or 'reload' with 'instance' None when many rows changed at once.
+    They are kept in app.extensions, so that only the caches of the app that made the write are told:
+    the app of the current context, else the app of setup_db.
+'''
+def on_change(app, name, listener):
+    app.extensions.setdefault('change_listeners', {})[name] = listener
+
+def notify_change(model, action, instance=None):
+    try:
+        app = db.get_app()
+    except RuntimeError:
+        return
+    for listener in list(app.extensions.get('change_listeners', {}).values()):
+        listener(model, action, instance)
+
+# ids for insert_all(), the sequence hands them out in one round trip
+NEXT_QUESTION_IDS = "SELECT nextval(pg_get_serial_sequence('questions', 'id')) FROM generate_series(1, :count)"
 
 '''
 Question
@@ -26,11 +147,16 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    # every per-category listing and quiz is a range scan on one of these
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -41,14 +167,48 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
+    QuestionCount.bump(self.category, 1)
     db.session.commit()
+    notify_change(Question, 'insert', self)
   
+  @classmethod
+  def insert_all(cls, questions, session=None):
+    '''
+    inserts many questions with a single commit of 'session', db.session by default, e.g. a batch
+    of the write-behind queue, and adjusts the counts in the same transaction.
+    On PostgreSQL the ids are drawn from the sequence first and the questions are a single INSERT,
+    so that every question gets its own id without being added to the session. Elsewhere the session inserts them.
+    '''
+    session = db.session if session is None else session
+    table = cls.__table__
+    if session.connection().dialect.name == 'postgresql':
+      question_ids = session.execute(text(NEXT_QUESTION_IDS), {'count': len(questions)}).fetchall()
+      for question, (question_id,) in zip(questions, question_ids):
+        question.id = question_id
+      session.execute(table.insert().values([
+        {'id': question.id, 'question': question.question, 'answer': question.answer, 'category': question.category, 'difficulty': question.difficulty}
+        for question in questions
+      ]))
+    else:
+      session.add_all(questions)
+    for category, total in Counter(question.category for question in questions).items():
+      QuestionCount.bump(category, total, session)
+    session.commit()
+    for question in questions:
+      notify_change(Question, 'insert', question)
+
   def update(self):
+    history = inspect(self).attrs.category.history
+    if history.deleted and history.added:
+      QuestionCount.move(history.deleted[0], history.added[0])
     db.session.commit()
+    notify_change(Question, 'update', self)
 
   def delete(self):
     db.session.delete(self)
+    QuestionCount.bump(self.category, -1)
     db.session.commit()
+    notify_change(Question, 'delete', self)
 
   def format(self):
     return {
@@ -59,6 +219,91 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+  @classmethod
+  def delete_all(cls, criteria, expected_ids=None):
+    '''
+    deletes every question matching 'criteria' with a single statement, adjusts the counts
+    in the same transaction and returns the ids of the deleted questions. The listeners are told about each of them.
+    If any of 'expected_ids' is not among them, nothing is deleted and LookupError lists the missing ones.
+    '''
+    rows = cls.bulk_rows(cls.__table__.delete(), criteria)
+    cls.check_expected(rows, expected_ids)
+
+    for category, total in Counter(category for _, category in rows).items():
+      QuestionCount.bump(category, -total)
+    db.session.commit()
+    # the listeners drop each deleted question, instead of reloading every question
+    for question_id, category in rows:
+      deleted = Question(None, None, category, None)
+      deleted.id = question_id
+      notify_change(Question, 'delete', deleted)
+    return [question_id for question_id, _ in rows]
+
+  @classmethod
+  def update_all(cls, criteria, values, expected_ids=None):
+    '''
+    sets the columns of 'values' on every question matching 'criteria' with a single statement,
+    like delete_all(), and moves the counts of the questions whose category changed.
+    '''
+    rows = cls.bulk_rows(cls.__table__.update().values(values), criteria)
+    cls.check_expected(rows, expected_ids)
+
+    if 'category' in values:
+      for category, total in Counter(category for _, category in rows).items():
+        if category != values['category']:
+          QuestionCount.bump(category, -total)
+          QuestionCount.bump(values['category'], total)
+    db.session.commit()
+    question_ids = [question_id for question_id, _ in rows]
+    # the listeners refresh each updated question from a single query, instead of reloading every question
+    if question_ids:
+      for question in cls.query.filter(cls.id.in_(question_ids)):
+        notify_change(Question, 'update', question)
+    return question_ids
+
+  @classmethod
+  def bulk_rows(cls, statement, criteria):
+    '''
+    runs a bulk UPDATE or DELETE of the questions matching 'criteria', and returns the id and the category
+    before the statement of every question it changed. On PostgreSQL that is the statement itself with RETURNING,
+    elsewhere the matching rows are locked and read first.
+    '''
+    table = cls.__table__
+    if db.session.connection().dialect.name != 'postgresql':
+      rows = db.session.query(cls.id, cls.category).filter(criteria).with_for_update().all()
+      if rows:
+        db.session.execute(statement.where(table.c.id.in_([question_id for question_id, _ in rows])))
+      return rows
+
+    if isinstance(statement, Delete):
+      statement = statement.where(criteria).returning(table.c.id, table.c.category)
+    else:
+      # RETURNING gives the new category, the old one comes from the rows joined in FROM
+      old = select([table.c.id, table.c.category]).where(criteria).alias('old')
+      statement = statement.where(table.c.id == old.c.id).returning(table.c.id, old.c.category)
+    return db.session.execute(statement).fetchall()
+
+  @staticmethod
+  def check_expected(rows, expected_ids):
+    if expected_ids is None:
+      return
+    missing = set(expected_ids) - {question_id for question_id, _ in rows}
+    if missing:
+      db.session.rollback()
+      raise LookupError(sorted(missing))
+
+  # the keys of format(), in the order of the columns selected by format_all()
+  FORMAT_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+  @classmethod
+  def format_all(cls, query):
+    '''
+    runs a question query selecting only the columns of format(), and builds the same dicts as format()
+    straight from the row tuples, without loading Question objects into the session
+    '''
+    columns = [getattr(cls, field) for field in cls.FORMAT_FIELDS]
+    return [dict(zip(cls.FORMAT_FIELDS, row)) for row in query.with_entities(*columns)]
+
 '''
 Category
 
@@ -72,8 +317,113 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    notify_change(Category, 'insert', self)
+
+  def update(self):
+    db.session.commit()
+    notify_change(Category, 'update', self)
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    notify_change(Category, 'delete', self)
+
   def format(self):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+QuestionCount
+    keeps the number of questions per category, and of all questions under ALL_CATEGORIES,
+    so that 'total_questions' is a primary key lookup instead of a count over the questions table.
+    Question.insert(), update() and delete() adjust the counts in the same transaction as the row change.
+    A missing count is recounted on the first read, and recount() repairs drifted counts.
+'''
+ALL_CATEGORIES = 0
+
+class QuestionCount(db.Model):
+  __tablename__ = 'question_counts'
+
+  category = Column(Integer, primary_key=True)
+  total = Column(Integer, nullable=False, default=0)
+
+  def __init__(self, category, total):
+    self.category = category
+    self.total = total
+
+  @classmethod
+  def get(cls, category=ALL_CATEGORIES):
+    total = db.session.query(cls.total).filter_by(category=category).scalar()
+    if total is None:
+      total = cls.recount(category)
+    return total
+
+  @classmethod
+  def bump(cls, category, delta, session=None):
+    keys = [ALL_CATEGORIES]
+    if category is not None:
+      keys.append(int(category))
+
+    # a count that does not exist yet is left alone, it is recounted when it is first read
+    query = cls.query if session is None else session.query(cls)
+    query.filter(cls.category.in_(keys)).update({cls.total: cls.total + delta}, synchronize_session=False)
+
+  @classmethod
+  def move(cls, old_category, new_category):
+    if old_category is not None:
+      cls.query.filter_by(category=int(old_category)).update({cls.total: cls.total - 1}, synchronize_session=False)
+    if new_category is not None:
+      cls.query.filter_by(category=int(new_category)).update({cls.total: cls.total + 1}, synchronize_session=False)
+
+  @classmethod
+  def recount(cls, category=None):
+    '''
+    recounts a single category (ALL_CATEGORIES for every question) and returns its total,
+    or recounts every category when 'category' is None and returns the number of all questions
+    '''
+    if category is None:
+      totals = dict(db.session.query(Question.category, func.count(Question.id)).filter(Question.category.isnot(None)).group_by(Question.category).all())
+      totals = {int(key): value for key, value in totals.items()}
+      totals[ALL_CATEGORIES] = db.session.query(func.count(Question.id)).scalar()
+      cls.query.delete(synchronize_session=False)
+    elif category == ALL_CATEGORIES:
+      totals = {category: db.session.query(func.count(Question.id)).scalar()}
+      cls.query.filter_by(category=category).delete(synchronize_session=False)
+    else:
+      totals = {category: Question.query.filter_by(category=category).with_entities(func.count(Question.id)).scalar()}
+      cls.query.filter_by(category=category).delete(synchronize_session=False)
+
+    db.session.add_all([cls(key, value) for key, value in totals.items()])
+    try:
+      db.session.commit()
+    except IntegrityError:
+      # another request stored the same count concurrently, its value is just as exact
+      db.session.rollback()
+
+    return totals[ALL_CATEGORIES if category is None else category]
+
+'''
+DataVersion
+    the single row of the data_version table, whose version is bumped by a database trigger
+    in the same transaction as every statement that writes questions or categories,
+    including bulk writes and edits made by hand. 'updated_at' is the time of the last such write.
+    The list endpoints derive their ETag and Last-Modified from it.
+'''
+class DataVersion(db.Model):
+  __tablename__ = 'data_version'
+
+  id = Column(Integer, primary_key=True)
+  version = Column(BigInteger, nullable=False, default=1)
+  updated_at = Column(DateTime(timezone=True), nullable=False)
+
+  @classmethod
+  def get(cls):
+    '''
+    the (version, updated_at) of the data, read with a single primary key lookup
+    '''
+    return db.session.query(cls.version, cls.updated_at).filter_by(id=1).one()
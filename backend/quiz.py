@@ -0,0 +1,337 @@
+import bisect
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from models import db, Question, ALL_CATEGORIES
+
+'''
+IdArray
+    a list of question ids with a position index, so that ids are added, removed
+    and drawn at random in O(1). Removing swaps the last id into the hole.
+    sorted_ids() is the ids in order, sorted once and then kept in order by add() and remove().
+'''
+class IdArray:
+
+  def __init__(self, ids):
+    self.ids = list(ids)
+    self.positions = {question_id: position for position, question_id in enumerate(self.ids)}
+    self.loaded_at = time.monotonic()
+    self._sorted = None
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, question_id):
+    return question_id in self.positions
+
+  def add(self, question_id):
+    if question_id not in self.positions:
+      self.positions[question_id] = len(self.ids)
+      self.ids.append(question_id)
+      if self._sorted is not None:
+        bisect.insort(self._sorted, question_id)
+
+  def remove(self, question_id):
+    position = self.positions.pop(question_id, None)
+    if position is None:
+      return
+    last_id = self.ids.pop()
+    if last_id != question_id:
+      self.ids[position] = last_id
+      self.positions[last_id] = position
+    if self._sorted is not None:
+      del self._sorted[bisect.bisect_left(self._sorted, question_id)]
+
+  def sorted_ids(self):
+    if self._sorted is None:
+      self._sorted = sorted(self.ids)
+    return self._sorted
+
+'''
+QuestionPool(ttl, categories)
+    caches the ids of the questions of every category (ALL_CATEGORIES for every question)
+    and draws a random question that has not been played yet without scanning the category.
+    'categories' returns the ids of the existing categories, an unknown category has no questions
+    and is neither queried nor cached, so that clients cannot fill the cache with made up ids.
+    The ids are kept current on writes in this process, writes made by other
+    worker processes are picked up after 'ttl' seconds.
+'''
+class QuestionPool:
+
+  # random picks tried before falling back to a scan of the remaining ids
+  max_rejections = 8
+
+  def __init__(self, ttl=60, categories=None):
+    self.ttl = ttl
+    self.categories = categories
+    self._arrays = {}
+    self._lock = threading.Lock()
+
+  def ids(self, category):
+    array = self._arrays.get(category)
+    if array is not None and time.monotonic() - array.loaded_at < self.ttl:
+      return array
+    if category != ALL_CATEGORIES and self.categories is not None and category not in self.categories():
+      return IdArray(())
+
+    query = db.session.query(Question.id)
+    if category != ALL_CATEGORIES:
+      query = query.filter(Question.category == category)
+    array = IdArray(question_id for question_id, in query.order_by(Question.id))
+
+    with self._lock:
+      self._arrays[category] = array
+    return array
+
+  def sample(self, category, count, previous_questions=(), rng=random, ordered=False):
+    '''
+    returns up to 'count' distinct random ids of 'category' that are not in 'previous_questions'.
+    Picks are retried while they hit a played or already picked id, the remaining ids are only listed
+    when most of the category has been played. With 'ordered' the ids are sampled in id order,
+    so that the same seeded 'rng' gives the same sample in every worker.
+    '''
+    array = self.ids(category)
+    ids = array.sorted_ids() if ordered else array.ids
+    played = set(previous_questions)
+    picked = []
+
+    if not ids:
+      return picked
+
+    rejections = 0
+    while len(picked) < count and rejections < self.max_rejections:
+      question_id = ids[rng.randrange(len(ids))]
+      if question_id in played:
+        rejections += 1
+      else:
+        picked.append(question_id)
+        played.add(question_id)
+
+    if len(picked) < count:
+      remaining = [question_id for question_id in ids if question_id not in played]
+      picked.extend(rng.sample(remaining, min(count - len(picked), len(remaining))))
+
+    return picked
+
+  def next_questions(self, category, count, previous_questions=(), rng=random, ordered=False):
+    '''
+    returns up to 'count' distinct random questions of 'category' that are not in 'previous_questions',
+    formatted and fetched with a single query. An id whose row is gone is dropped and another one is drawn.
+    '''
+    questions = []
+    played = set(previous_questions)
+
+    while len(questions) < count:
+      question_ids = self.sample(category, count - len(questions), played, rng, ordered)
+      if not question_ids:
+        break
+
+      rows = {question['id']: question for question in Question.format_all(Question.query.filter(Question.id.in_(question_ids)))}
+      for question_id in question_ids:
+        played.add(question_id)
+        if question_id in rows:
+          questions.append(rows[question_id])
+        else:
+          self.discard(question_id)
+
+    return questions
+
+  def next_question(self, category, previous_questions, rng=random):
+    '''
+    returns a random formatted question of 'category' that is not in 'previous_questions', or None if every question was played
+    '''
+    questions = self.next_questions(category, 1, previous_questions, rng)
+    return questions[0] if questions else None
+
+  def discard(self, question_id):
+    with self._lock:
+      for array in self._arrays.values():
+        array.remove(question_id)
+
+  def invalidate(self):
+    with self._lock:
+      self._arrays = {}
+
+  def on_change(self, model, action, instance):
+    if model is not Question:
+      return
+
+    if action == 'insert':
+      with self._lock:
+        for category in (ALL_CATEGORIES, instance.category):
+          array = self._arrays.get(None if category is None else int(category))
+          if array is not None:
+            array.add(instance.id)
+    elif action == 'delete':
+      self.discard(instance.id)
+    else:
+      # the category of a question may have changed
+      self.invalidate()
+
+'''
+QuizSession
+    the shuffled question ids still to be played in a quiz, the next one is at the end of the deck
+'''
+class QuizSession:
+
+  def __init__(self, category, deck, expires_at):
+    self.category = category
+    self.deck = deck
+    self.played = 0
+    self.expires_at = expires_at
+
+  def format(self, session_id):
+    return {
+      'id': session_id,
+      'category': self.category,
+      'played': self.played,
+      'remaining': len(self.deck)
+    }
+
+'''
+MemorySessionStore(ttl)
+    keeps quiz sessions in this process and forgets a session 'ttl' seconds after it was last used.
+    Sessions are kept in the order they were last used, so expired ones are evicted from the front.
+    Quiz sessions are only visible to the worker that created them, use RedisSessionStore to share them.
+'''
+class MemorySessionStore:
+
+  def __init__(self, ttl=3600, clock=time.monotonic):
+    self.ttl = ttl
+    self.clock = clock
+    self._sessions = OrderedDict()
+    self._lock = threading.Lock()
+
+  def _evict(self, now):
+    while self._sessions:
+      session_id, session = next(iter(self._sessions.items()))
+      if session.expires_at > now:
+        break
+      del self._sessions[session_id]
+
+  def _touch(self, session_id, now):
+    session = self._sessions.get(session_id)
+    if session is None or session.expires_at <= now:
+      raise KeyError(session_id)
+    session.expires_at = now + self.ttl
+    self._sessions.move_to_end(session_id)
+    return session
+
+  def create(self, session_id, category, deck):
+    with self._lock:
+      now = self.clock()
+      self._evict(now)
+      self._sessions[session_id] = QuizSession(category, list(deck), now + self.ttl)
+
+  def get(self, session_id):
+    with self._lock:
+      return self._touch(session_id, self.clock()).format(session_id)
+
+  def pop(self, session_id):
+    with self._lock:
+      session = self._touch(session_id, self.clock())
+      if not session.deck:
+        return None
+      session.played += 1
+      return session.deck.pop()
+
+  def delete(self, session_id):
+    with self._lock:
+      if self._sessions.pop(session_id, None) is None:
+        raise KeyError(session_id)
+
+'''
+RedisSessionStore(url, ttl)
+    keeps quiz sessions in Redis, so every worker can serve every session.
+    The deck is a Redis list popped with RPOP, the category and the number of played questions are a hash.
+    Both keys expire 'ttl' seconds after the session was last used. Needs the 'redis' package.
+'''
+class RedisSessionStore:
+
+  def __init__(self, url, ttl=3600, prefix='trivia:quiz:'):
+    import redis
+
+    self.redis = redis.Redis.from_url(url)
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def _keys(self, session_id):
+    return self.prefix + session_id + ':deck', self.prefix + session_id + ':meta'
+
+  def create(self, session_id, category, deck):
+    deck_key, meta_key = self._keys(session_id)
+    pipe = self.redis.pipeline()
+    pipe.hset(meta_key, mapping={'category': category, 'played': 0})
+    if deck:
+      pipe.rpush(deck_key, *deck)
+    pipe.expire(meta_key, self.ttl)
+    pipe.expire(deck_key, self.ttl)
+    pipe.execute()
+
+  def get(self, session_id):
+    deck_key, meta_key = self._keys(session_id)
+    pipe = self.redis.pipeline()
+    pipe.hgetall(meta_key)
+    pipe.llen(deck_key)
+    pipe.expire(meta_key, self.ttl)
+    pipe.expire(deck_key, self.ttl)
+    meta, remaining, _, _ = pipe.execute()
+    if not meta:
+      raise KeyError(session_id)
+    return {
+      'id': session_id,
+      'category': int(meta[b'category']),
+      'played': int(meta[b'played']),
+      'remaining': remaining
+    }
+
+  def pop(self, session_id):
+    deck_key, meta_key = self._keys(session_id)
+    if not self.redis.expire(meta_key, self.ttl):
+      raise KeyError(session_id)
+
+    pipe = self.redis.pipeline()
+    pipe.rpop(deck_key)
+    pipe.expire(deck_key, self.ttl)
+    question_id, _ = pipe.execute()
+    if question_id is None:
+      return None
+    self.redis.hincrby(meta_key, 'played', 1)
+    return int(question_id)
+
+  def delete(self, session_id):
+    if not self.redis.delete(*self._keys(session_id)):
+      raise KeyError(session_id)
+
+'''
+make_session_store(config)
+    builds the quiz session store named by QUIZ_SESSION_BACKEND, 'memory' (default) or 'redis'
+'''
+SESSION_STORES = {
+  'memory': lambda config: MemorySessionStore(config.get('QUIZ_SESSION_TTL', 3600)),
+  'redis': lambda config: RedisSessionStore(config['QUIZ_SESSION_REDIS_URL'], config.get('QUIZ_SESSION_TTL', 3600)),
+}
+
+def make_session_store(config):
+  return SESSION_STORES[config.get('QUIZ_SESSION_BACKEND', 'memory')](config)
+
+'''
+new_session_id()
+    an unguessable id for a quiz session
+'''
+def new_session_id():
+  return secrets.token_urlsafe(16)
+
+'''
+shuffled_deck(pool, category, size=None, rng=random)
+    shuffles the ids of 'category' once, keeping at most 'size' of them
+'''
+def shuffled_deck(pool, category, size=None, rng=random):
+  deck = list(pool.ids(category).ids)
+  rng.shuffle(deck)
+  if size is not None:
+    deck = deck[:size]
+  return deck
@@ -0,0 +1,247 @@
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context
+
+from models import Question
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+'''
+JSON encoders
+    dumps(payload, sort_keys, indent) of the stdlib json module, and of orjson and ujson when they are installed.
+    They all escape non-ASCII characters except orjson, which writes UTF-8.
+    'fragments' tells whether splicing cached question fragments beats encoding the questions again,
+    see benchmarks/json_encoders.py.
+'''
+class StdlibEncoder:
+
+  name = 'json'
+  fragments = True
+
+  def dumps(self, payload, sort_keys, indent):
+    if indent:
+      return json.dumps(payload, sort_keys=sort_keys, indent=indent, separators=(',', ': '))
+    return json.dumps(payload, sort_keys=sort_keys, separators=(',', ':'))
+
+class OrjsonEncoder:
+
+  name = 'orjson'
+  fragments = False
+
+  def __init__(self):
+    import orjson
+
+    self.orjson = orjson
+
+  def dumps(self, payload, sort_keys, indent):
+    option = self.orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+      option |= self.orjson.OPT_SORT_KEYS
+    if indent:
+      option |= self.orjson.OPT_INDENT_2
+    return self.orjson.dumps(payload, option=option).decode('utf-8')
+
+class UjsonEncoder:
+
+  name = 'ujson'
+  fragments = False
+
+  def __init__(self):
+    import ujson
+
+    self.ujson = ujson
+
+  def dumps(self, payload, sort_keys, indent):
+    return self.ujson.dumps(payload, sort_keys=sort_keys, indent=indent or 0, ensure_ascii=True, escape_forward_slashes=False)
+
+JSON_ENCODERS = {
+  'orjson': OrjsonEncoder,
+  'ujson': UjsonEncoder,
+  'json': StdlibEncoder,
+}
+
+'''
+load_encoder(name)
+    the JSON encoder called 'name', or with 'auto' the fastest one that is installed.
+    Raises ImportError if the encoder named is not installed.
+'''
+def load_encoder(name='auto'):
+  if name != 'auto':
+    return JSON_ENCODERS[name]()
+
+  for encoder in JSON_ENCODERS.values():
+    try:
+      return encoder()
+    except ImportError:
+      continue
+
+'''
+FragmentCache(encode, size)
+    the JSON encoding of formatted questions by id, so that list responses concatenate cached fragments
+    instead of encoding every question again. A fragment is used only while the question it was
+    encoded from equals the row just read, so writes made by other workers never serve stale JSON.
+    It holds at most 'size' questions and drops the least recently used ones first.
+'''
+class FragmentCache:
+
+  def __init__(self, encode, size=10000):
+    self.encode = encode
+    self.size = size
+    self._fragments = OrderedDict()
+    self._lock = threading.Lock()
+
+  def fragment(self, question):
+    question_id = question['id']
+    with self._lock:
+      cached = self._fragments.get(question_id)
+      if cached is not None and cached[0] == question:
+        self._fragments.move_to_end(question_id)
+        return cached[1]
+
+    fragment = self.encode(question)
+    self.store(question, fragment)
+    return fragment
+
+  def get(self, question_id):
+    '''
+    the cached fragment of a question, or None
+    '''
+    with self._lock:
+      cached = self._fragments.get(question_id)
+    return None if cached is None else cached[1]
+
+  def store(self, question, fragment=None):
+    if fragment is None:
+      fragment = self.encode(question)
+    with self._lock:
+      self._fragments[question['id']] = (question, fragment)
+      self._fragments.move_to_end(question['id'])
+      while len(self._fragments) > self.size:
+        self._fragments.popitem(last=False)
+
+  def evict(self, question_id):
+    with self._lock:
+      self._fragments.pop(question_id, None)
+
+  def on_change(self, model, action, instance):
+    if model is not Question:
+      return
+
+    if action in ('insert', 'update'):
+      self.store(instance.format())
+    elif action == 'delete':
+      self.evict(instance.id)
+    elif action == 'reload':
+      with self._lock:
+        self._fragments.clear()
+
+  def __len__(self):
+    return len(self._fragments)
+
+# a string that no formatted payload contains, it marks where the questions go
+QUESTIONS_MARKER = '\x00questions\x00'
+
+'''
+JsonResponder(encoder, compact, fragment_cache_size)
+    builds the JSON responses of the app with 'encoder', in place of jsonify.
+    By default the keys are sorted and the output is pretty-printed in debug mode, like jsonify.
+    'compact' never pretty-prints and leaves the keys unsorted, which is faster.
+    The time spent encoding is added up per request in g.json_encode_time.
+'''
+class JsonResponder:
+
+  def __init__(self, encoder, compact=False, fragment_cache_size=10000):
+    self.encoder = encoder
+    self.compact = compact
+    self.fragments = FragmentCache(self.encode_fragment, fragment_cache_size)
+
+  def pretty(self):
+    return not self.compact and (current_app.config.get('JSONIFY_PRETTYPRINT_REGULAR') or current_app.debug)
+
+  def dumps(self, payload):
+    return self.encoder.dumps(payload, not self.compact, 2 if self.pretty() else None)
+
+  def encode_fragment(self, question):
+    return self.encoder.dumps(question, not self.compact, None)
+
+  def record_encode_time(self, start):
+    if has_app_context():
+      g.json_encode_time = g.get('json_encode_time', 0.0) + time.perf_counter() - start
+
+  def response(self, payload, status=200):
+    start = time.perf_counter()
+    body = self.dumps(payload) + '\n'
+    self.record_encode_time(start)
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+  def questions_response(self, payload, key, status=200):
+    '''
+    the response of 'payload' where payload[key] is a formatted question, a list of them or None.
+    The questions are spliced in from their cached fragments instead of being encoded, if the encoder is
+    slow enough for that to pay. Pretty-printed responses are encoded as a whole.
+    '''
+    questions = payload[key]
+    if questions is None or not self.encoder.fragments or self.pretty():
+      return self.response(payload, status)
+
+    start = time.perf_counter()
+    if isinstance(questions, dict):
+      encoded_questions = self.fragments.fragment(questions)
+    else:
+      encoded_questions = '[' + ','.join(self.fragments.fragment(question) for question in questions) + ']'
+
+    envelope = dict(payload)
+    envelope[key] = QUESTIONS_MARKER
+    body = self.dumps(envelope).replace(self.encoder.dumps(QUESTIONS_MARKER, False, None), encoded_questions, 1)
+    self.record_encode_time(start)
+
+    return current_app.response_class(body + '\n', status=status, mimetype='application/json')
+
+'''
+Compressor(min_size, level, brotli_level)
+    compresses JSON responses of at least 'min_size' bytes with brotli, if it is installed and the client
+    accepts it, or else with gzip at 'level'. It adds 'Vary: Accept-Encoding' to every JSON response,
+    and weakens a strong ETag of a compressed response, as its bytes are no longer those the tag was made for.
+'''
+class Compressor:
+
+  mimetypes = ('application/json',)
+
+  def __init__(self, min_size=500, level=6, brotli_level=4):
+    self.min_size = min_size
+    self.level = level
+    self.brotli_level = brotli_level
+    self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+  def compress(self, response, accept_encodings):
+    if response.status_code != 304 and response.mimetype not in self.mimetypes:
+      return response
+    response.vary.add('Accept-Encoding')
+
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+      return response
+
+    data = response.get_data()
+    if len(data) < self.min_size:
+      return response
+
+    encoding = accept_encodings.best_match(self.encodings)
+    if encoding == 'br':
+      response.set_data(brotli.compress(data, quality=self.brotli_level))
+    elif encoding == 'gzip':
+      response.set_data(gzip.compress(data, self.level))
+    else:
+      return response
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+      response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,101 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from sqlalchemy.sql.expression import Insert, Update, Delete
+
+REPLICA_BIND_PREFIX = 'replica'
+
+'''
+RoutingSession
+    the session of Flask-SQLAlchemy, except that the reads of a request routed to a replica
+    (g.replica, a bind name set by flaskr.read_only) go to that replica.
+    Flushes and INSERT, UPDATE and DELETE statements always go to the primary.
+'''
+class RoutingSession(SignallingSession):
+
+  def __init__(self, db, **options):
+    self.db = db
+    super().__init__(db, **options)
+
+  def get_bind(self, mapper=None, clause=None):
+    replica = g.get('replica') if has_app_context() else None
+    if replica is None or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+      return super().get_bind(mapper, clause)
+    return self.db.get_engine(self.app, bind=replica)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+'''
+ReplicaRouter(db, app, binds, selection, retry_after)
+    picks the replica of each read-only request among the binds of the app, either in turn ('round_robin')
+    or the one with the fewest connections checked out of its pool ('least_connections').
+    A replica that fails to connect or loses its connection is left out for 'retry_after' seconds,
+    the request that saw it fail sets g.replica_failed and is run again on the primary.
+    choose() returns None, the primary, when every replica is down.
+'''
+class ReplicaRouter:
+
+  SELECTIONS = ('round_robin', 'least_connections')
+
+  def __init__(self, db, app, binds, selection='round_robin', retry_after=30, clock=time.monotonic):
+    if selection not in self.SELECTIONS:
+      raise ValueError(f'unknown replica selection {selection}, use one of {self.SELECTIONS}')
+    self.db = db
+    self.app = app
+    self.binds = list(binds)
+    self.selection = selection
+    self.retry_after = retry_after
+    self.clock = clock
+    self._turns = itertools.cycle(self.binds)
+    self._down_until = {}
+    self._engines = {}
+    self._lock = threading.Lock()
+
+  def engine(self, bind):
+    with self._lock:
+      engine = self._engines.get(bind)
+      if engine is None:
+        engine = self._engines[bind] = self.db.get_engine(self.app, bind=bind)
+        event.listen(engine, 'handle_error', self._failure_listener(bind))
+    return engine
+
+  def _failure_listener(self, bind):
+    def on_error(context):
+      if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+        self.mark_down(bind)
+        if has_app_context():
+          g.replica_failed = True
+    return on_error
+
+  def mark_down(self, bind):
+    with self._lock:
+      self._down_until[bind] = self.clock() + self.retry_after
+
+  def available(self):
+    now = self.clock()
+    with self._lock:
+      return [bind for bind in self.binds if self._down_until.get(bind, 0) <= now]
+
+  def choose(self):
+    available = self.available()
+    if not available:
+      return None
+
+    if self.selection == 'least_connections':
+      # a pool without a count of its connections, e.g. the NullPool of SQLite, counts as empty
+      return min(available, key=lambda bind: getattr(self.engine(bind).pool, 'checkedout', lambda: 0)())
+
+    with self._lock:
+      for _ in range(len(self.binds)):
+        bind = next(self._turns)
+        if bind in available:
+          break
+    self.engine(bind)
+    return bind
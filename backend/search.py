@@ -0,0 +1,399 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from sqlalchemy import func, literal, literal_column, or_
+
+from models import Question, DataVersion
+
+'''
+search modes of POST /questions
+    'substring'  matches questions that include the search term, like ILIKE '%term%' (the default),
+                 and ranks them by how early the term appears in the question.
+    'fulltext'   matches questions and answers with PostgreSQL full-text search and ranks them by ts_rank.
+                 Needs migrations/0001_question_search_vector.py.
+    'fuzzy'      matches questions with a word similar to the search term, or a similar answer, so that typos
+                 still match, and ranks them by trigram similarity. Needs migrations/0002_question_trigram_indexes.py
+                 and the pg_trgm extension, which also make the 'substring' mode an index scan.
+    'index'      matches questions and answers in the InvertedIndex kept in memory by the app, without
+                 querying the database. Every word of the search term must match, the last one as a prefix.
+                 Needs SEARCH_INDEX enabled.
+'''
+SEARCH_CONFIG = 'english'
+
+# maintained by a trigger, it is not mapped on Question so that it is never loaded with the questions
+SEARCH_VECTOR = literal_column('questions.search_vector')
+
+class SubstringSearch:
+
+  def filter(self, search_term):
+    return Question.question.ilike(f'%{search_term}%')
+
+  def order_by(self, search_term):
+    # the earlier the term appears in the question, the more relevant the question
+    return [func.strpos(func.lower(Question.question), search_term.lower()), Question.id]
+
+class FullTextSearch:
+
+  def query(self, search_term):
+    return func.plainto_tsquery(SEARCH_CONFIG, search_term)
+
+  def filter(self, search_term):
+    return SEARCH_VECTOR.op('@@')(self.query(search_term))
+
+  def order_by(self, search_term):
+    return [func.ts_rank(SEARCH_VECTOR, self.query(search_term)).desc(), Question.id]
+
+class FuzzySearch:
+
+  def filter(self, search_term):
+    # '<%' compares the term with the most similar part of the question, '%' with the whole answer.
+    # The percent signs are doubled for the pyformat parameters of psycopg2.
+    term = literal(search_term)
+    return or_(term.op('<%%')(Question.question), term.op('%%')(Question.answer))
+
+  def order_by(self, search_term):
+    similarity = func.greatest(func.word_similarity(search_term, Question.question), func.similarity(search_term, Question.answer))
+    return [similarity.desc(), Question.id]
+
+SEARCH_MODES = {
+  'substring': SubstringSearch(),
+  'fulltext': FullTextSearch(),
+  'fuzzy': FuzzySearch(),
+}
+
+'''
+search_questions(query, mode, search_term, limit, offset=0)
+    filters a question query by 'search_term', orders the matches by relevance, the most relevant first,
+    and keeps 'limit' of them from 'offset' on
+'''
+def search_questions(query, mode, search_term, limit, offset=0):
+  search = SEARCH_MODES[mode]
+  query = query.filter(search.filter(search_term))
+  return query.order_by(*search.order_by(search_term)).offset(offset).limit(limit)
+
+'''
+search_facets(query, mode, search_term)
+    counts the matches of 'search_term' per (category, difficulty) in a single GROUP BY pass.
+    The few rows it returns are all summarize_facets() needs for the total and both facets.
+'''
+def search_facets(query, mode, search_term):
+  query = query.filter(SEARCH_MODES[mode].filter(search_term))
+  query = query.with_entities(Question.category, Question.difficulty, func.count(Question.id))
+  return query.group_by(Question.category, Question.difficulty).all()
+
+'''
+summarize_facets(counts, category=None, difficulty=None)
+    turns (category, difficulty, count) rows into the number of matches in the selected category
+    and difficulty, and the facets: the number of matches per category within the selected difficulty
+    and per difficulty within the selected category
+'''
+def summarize_facets(counts, category=None, difficulty=None):
+  total = 0
+  facets = {'category': {}, 'difficulty': {}}
+
+  for row_category, row_difficulty, count in counts:
+    row_category = None if row_category is None else int(row_category)
+    in_category = category is None or row_category == category
+    in_difficulty = difficulty is None or row_difficulty == difficulty
+
+    # questions left without a category when it was deleted are only counted in the total
+    if in_difficulty and row_category is not None:
+      facets['category'][row_category] = facets['category'].get(row_category, 0) + count
+    if in_category:
+      facets['difficulty'][row_difficulty] = facets['difficulty'].get(row_difficulty, 0) + count
+    if in_category and in_difficulty:
+      total += count
+
+  return total, facets
+
+'''
+tokenize(text)
+    the lower-cased words of a text
+'''
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text):
+  if not text:
+    return []
+  return TOKEN_PATTERN.findall(text.lower())
+
+'''
+QuestionIndex(ttl)
+    an index of the questions held in memory, built from the formatted questions by build()
+    and kept current by on_change() on the writes of this process.
+    refresh() builds it on first use, and rebuilds it when it is 'ttl' seconds old and the DataVersion
+    has changed since, so that writes made by other worker processes are seen within 'ttl' seconds.
+    A single request builds or rebuilds it, while a rebuild runs the others use the current index.
+'''
+class QuestionIndex:
+
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self.built = False
+    self.version = None
+    self.checked_at = 0.0
+    self._build_lock = threading.Lock()
+
+  def fresh(self):
+    return self.built and time.monotonic() - self.checked_at < self.ttl
+
+  def refresh(self):
+    if self.fresh():
+      return
+    # the first build makes the others wait for it, a rebuild does not
+    if not self._build_lock.acquire(blocking=not self.built):
+      return
+    try:
+      if self.fresh():
+        return
+      # read before the questions, so that a write in between is picked up by the next refresh
+      version, _ = DataVersion.get()
+      if not self.built or version != self.version:
+        self.build(Question.format_all(Question.query))
+      self.version = version
+      self.checked_at = time.monotonic()
+    finally:
+      self._build_lock.release()
+
+'''
+InvertedIndex(ttl)
+    an in-memory index of the words of every question and answer, to search without the database.
+    'postings' maps a word to the ids of the questions that contain it, 'terms' is the sorted
+    vocabulary for prefix lookups and 'documents' keeps the formatted questions to return.
+'''
+class InvertedIndex(QuestionIndex):
+
+  def __init__(self, ttl=60):
+    super().__init__(ttl)
+    self.postings = {}
+    self.terms = []
+    self.documents = {}
+    self._lock = threading.Lock()
+
+  def build(self, documents):
+    with self._lock:
+      self.postings = {}
+      self.terms = []
+      self.documents = {}
+      for document in documents:
+        self._add(document, sort_terms=False)
+      self.terms = sorted(self.postings)
+      self.built = True
+
+  def _add(self, document, sort_terms=True):
+    question_id = document['id']
+    self.documents[question_id] = document
+    for token in set(tokenize(document['question']) + tokenize(document['answer'])):
+      postings = self.postings.get(token)
+      if postings is None:
+        postings = self.postings[token] = set()
+        if sort_terms:
+          bisect.insort(self.terms, token)
+      postings.add(question_id)
+
+  def _remove(self, question_id):
+    document = self.documents.pop(question_id, None)
+    if document is None:
+      return
+    for token in set(tokenize(document['question']) + tokenize(document['answer'])):
+      postings = self.postings.get(token)
+      if postings is None:
+        continue
+      postings.discard(question_id)
+      if not postings:
+        del self.postings[token]
+        position = bisect.bisect_left(self.terms, token)
+        if position < len(self.terms) and self.terms[position] == token:
+          del self.terms[position]
+
+  def add(self, question):
+    with self._lock:
+      self._remove(question.id)
+      self._add(question.format())
+
+  def remove(self, question_id):
+    with self._lock:
+      self._remove(question_id)
+
+  def _prefixed(self, prefix):
+    start = bisect.bisect_left(self.terms, prefix)
+    end = bisect.bisect_left(self.terms, prefix + '\uffff')
+    return self.terms[start:end]
+
+  def search(self, search_term):
+    '''
+    returns the ids of the questions that contain every word of 'search_term', the last word may be
+    the beginning of a longer word. The questions with the whole last word come first, in the order of their ids.
+    '''
+    tokens = tokenize(search_term)
+    if not tokens:
+      return []
+
+    with self._lock:
+      matches = [self.postings.get(token, set()) for token in tokens[:-1]]
+      prefixed = set()
+      for term in self._prefixed(tokens[-1]):
+        prefixed |= self.postings[term]
+      matches.append(prefixed)
+
+      # intersect from the rarest word on
+      matches.sort(key=len)
+      question_ids = set(matches[0])
+      for postings in matches[1:]:
+        if not question_ids:
+          break
+        question_ids &= postings
+
+      whole_words = self.postings.get(tokens[-1], set())
+
+    return sorted(question_ids, key=lambda question_id: (question_id not in whole_words, question_id))
+
+  def on_change(self, model, action, instance):
+    if model is not Question:
+      return
+
+    if action in ('insert', 'update'):
+      self.add(instance)
+    elif action == 'delete':
+      self.remove(instance.id)
+    elif action == 'reload':
+      self.build(Question.format_all(Question.query))
+
+'''
+Suggester(ttl, top_k, prefix_length)
+    search-as-you-type completions: the words of the questions and the whole answers, kept in a sorted
+    array so that the completions of a prefix are a bisect range. A completion is ranked by the number
+    of questions it comes from. It is built on the first suggestion.
+    The ranges of the prefixes of up to 'prefix_length' characters span much of the vocabulary, so their
+    best 'top_k' completions are kept ranked in 'top' and refreshed when a count changes,
+    instead of being ranked on every keystroke.
+'''
+class Suggester(QuestionIndex):
+
+  def __init__(self, ttl=60, top_k=10, prefix_length=3):
+    super().__init__(ttl)
+    self.top_k = top_k
+    self.prefix_length = prefix_length
+    self.keys = []
+    self.counts = {}
+    self.texts = {}
+    self.top = {}
+    self.documents = {}
+    self._lock = threading.Lock()
+
+  def _completions(self, document):
+    completions = {token: token for token in tokenize(document['question'])}
+    answer = (document['answer'] or '').strip()
+    if answer:
+      completions.setdefault(answer.lower(), answer)
+    return completions
+
+  def _rank(self, key):
+    return (-self.counts[key], key)
+
+  def _prefixes(self, key):
+    return [key[:length] for length in range(1, min(len(key), self.prefix_length) + 1)]
+
+  def _add(self, document, incremental=True):
+    for key, text in self._completions(document).items():
+      count = self.counts.get(key, 0)
+      if count == 0:
+        self.texts[key] = text
+        if incremental:
+          bisect.insort(self.keys, key)
+      self.counts[key] = count + 1
+      if incremental:
+        self._raise(key)
+
+  def _remove(self, document):
+    for key in self._completions(document):
+      count = self.counts.get(key, 0) - 1
+      if count > 0:
+        self.counts[key] = count
+      elif key in self.counts:
+        del self.counts[key]
+        del self.texts[key]
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+          del self.keys[position]
+      else:
+        continue
+      self._lower(key)
+
+  def _raise(self, key):
+    # a count went up, the key can only move up in the top of its prefixes or enter it
+    for prefix in self._prefixes(key):
+      top = self.top.setdefault(prefix, [])
+      if key in top:
+        top.sort(key=self._rank)
+      elif len(top) < self.top_k or self._rank(key) < self._rank(top[-1]):
+        top.append(key)
+        top.sort(key=self._rank)
+        del top[self.top_k:]
+
+  def _lower(self, key):
+    # a count went down or the key is gone, the next best of the range may take its place
+    for prefix in self._prefixes(key):
+      if key in self.top.get(prefix, ()):
+        top = self._rank_range(prefix, self.top_k)
+        if top:
+          self.top[prefix] = top
+        else:
+          del self.top[prefix]
+
+  def _rank_range(self, prefix, limit):
+    start = bisect.bisect_left(self.keys, prefix)
+    end = bisect.bisect_left(self.keys, prefix + '\uffff')
+    return heapq.nsmallest(limit, self.keys[start:end], key=self._rank)
+
+  def build(self, documents):
+    with self._lock:
+      self.counts = {}
+      self.texts = {}
+      self.documents = {}
+      for document in documents:
+        self.documents[document['id']] = document
+        self._add(document, incremental=False)
+      self.keys = sorted(self.counts)
+
+      candidates = {}
+      for key in self.keys:
+        for prefix in self._prefixes(key):
+          candidates.setdefault(prefix, []).append(key)
+      self.top = {prefix: heapq.nsmallest(self.top_k, keys, key=self._rank) for prefix, keys in candidates.items()}
+      self.built = True
+
+  def suggest(self, prefix, limit):
+    '''
+    returns up to 'limit' completions of 'prefix', the most frequent first
+    '''
+    prefix = prefix.strip().lower()
+    if not prefix:
+      return []
+
+    with self._lock:
+      if len(prefix) <= self.prefix_length and limit <= self.top_k:
+        best = self.top.get(prefix, [])[:limit]
+      else:
+        best = self._rank_range(prefix, limit)
+      return [self.texts[key] for key in best]
+
+  def on_change(self, model, action, instance):
+    if model is not Question or not self.built:
+      return
+
+    if action == 'reload':
+      self.build(Question.format_all(Question.query))
+      return
+
+    with self._lock:
+      document = self.documents.pop(instance.id, None)
+      if document is not None:
+        self._remove(document)
+      if action in ('insert', 'update'):
+        document = instance.format()
+        self.documents[instance.id] = document
+        self._add(document)
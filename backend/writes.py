@@ -0,0 +1,192 @@
+import atexit
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from models import db, Question
+
+'''
+PendingInsert(ticket, values, queued_at)
+    a question waiting in the write-behind queue, and the future of its insert.
+    Its status is 'pending' until the batch it is in has been committed ('committed') or rolled back ('failed').
+    wait(timeout) blocks until then and returns the formatted question or raises RuntimeError.
+'''
+class PendingInsert:
+
+  def __init__(self, ticket, values, queued_at):
+    self.ticket = ticket
+    self.values = values
+    self.queued_at = queued_at
+    self.resolved_at = None
+    self.question = None
+    self.error = None
+    self._done = threading.Event()
+
+  @property
+  def status(self):
+    if not self._done.is_set():
+      return 'pending'
+    return 'failed' if self.error is not None else 'committed'
+
+  def resolve(self, question, now):
+    self.question = question
+    self.resolved_at = now
+    self._done.set()
+
+  def fail(self, error, now):
+    self.error = str(error) or error.__class__.__name__
+    self.resolved_at = now
+    self._done.set()
+
+  def wait(self, timeout=None):
+    if not self._done.wait(timeout):
+      raise TimeoutError(self.ticket)
+    if self.error is not None:
+      raise RuntimeError(self.error)
+    return self.question
+
+  def format(self):
+    formatted = {
+      'ticket': self.ticket,
+      'status': self.status
+    }
+    if self.question is not None:
+      formatted['question'] = self.question
+    return formatted
+
+'''
+WriteBehindQueue(app, interval, batch_size, max_pending, ticket_ttl)
+    queues question inserts in this process and commits them in batches from a background thread,
+    once 'batch_size' questions are waiting or 'interval' seconds after the oldest one was queued,
+    so that a burst of POST '/add' pays for one commit per batch instead of one per question.
+
+    Durability: a queued question is only in the memory of this worker until its batch is committed.
+    If the process is killed or crashes before that, the questions still pending are lost and their
+    tickets with them. On a normal exit the queue is flushed. A batch is one transaction, if it fails
+    its questions are retried one at a time, so only the questions that cannot be inserted fail.
+    Tickets are remembered 'ticket_ttl' seconds after they are resolved, and only by the worker that queued them.
+'''
+class WriteBehindQueue:
+
+  def __init__(self, app, interval=0.05, batch_size=100, max_pending=10000, ticket_ttl=600, clock=time.monotonic):
+    self.app = app
+    self.interval = interval
+    self.batch_size = batch_size
+    self.max_pending = max_pending
+    self.ticket_ttl = ticket_ttl
+    self.clock = clock
+    self._pending = []
+    self._tickets = OrderedDict()
+    self._condition = threading.Condition()
+    self._thread = None
+    self._closed = False
+    atexit.register(self.close)
+
+  def submit(self, values):
+    '''
+    queues the insert of a question with the columns of 'values' and returns its PendingInsert,
+    or None if the queue is full or closed, then the caller inserts it synchronously
+    '''
+    with self._condition:
+      if self._closed or len(self._pending) >= self.max_pending:
+        return None
+
+      now = self.clock()
+      self._expire(now)
+      pending = PendingInsert(secrets.token_urlsafe(16), values, now)
+      self._pending.append(pending)
+      self._tickets[pending.ticket] = pending
+
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+      # wakes the flusher to start the interval of a new batch, or to commit a full one
+      self._condition.notify()
+    return pending
+
+  def get(self, ticket):
+    with self._condition:
+      self._expire(self.clock())
+      return self._tickets.get(ticket)
+
+  def flush(self):
+    '''
+    commits every question still pending now, in the calling thread
+    '''
+    with self._condition:
+      batch, self._pending = self._pending, []
+    if batch:
+      self._write(batch)
+
+  def close(self):
+    with self._condition:
+      self._closed = True
+      self._condition.notify()
+    if self._thread is not None:
+      self._thread.join(timeout=max(self.interval * 10, 5))
+    self.flush()
+
+  def _expire(self, now):
+    # tickets are kept in the order they were queued, resolved ones are forgotten after ticket_ttl
+    while self._tickets:
+      ticket, pending = next(iter(self._tickets.items()))
+      if pending.resolved_at is None or pending.resolved_at + self.ticket_ttl > now:
+        break
+      del self._tickets[ticket]
+
+  def _run(self):
+    while True:
+      with self._condition:
+        while not self._pending and not self._closed:
+          self._condition.wait()
+        if not self._pending:
+          return
+
+        deadline = self._pending[0].queued_at + self.interval
+        while len(self._pending) < self.batch_size and not self._closed:
+          remaining = deadline - self.clock()
+          if remaining <= 0:
+            break
+          self._condition.wait(remaining)
+
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+
+      # flush() may have taken the batch meanwhile
+      if batch:
+        self._write(batch)
+
+  def _write(self, batch):
+    # flush() may run in a request of this app, whose context is then used as is
+    if has_app_context() and current_app._get_current_object() is self.app:
+      self._write_batch(batch)
+    else:
+      with self.app.app_context():
+        self._write_batch(batch)
+
+  def _write_batch(self, batch):
+    # a session of its own, which leaves the session of the calling thread alone and keeps the new rows
+    # loaded after the commit, so that format() and the change listeners read them without a SELECT each
+    session = db.create_session({'expire_on_commit': False})()
+    try:
+      questions = [Question(**pending.values) for pending in batch]
+      Question.insert_all(questions, session)
+      now = self.clock()
+      for pending, question in zip(batch, questions):
+        pending.resolve(question.format(), now)
+    except Exception:
+      session.rollback()
+      # one bad question rolls back the whole batch, so the batch is retried one question at a time
+      for pending in batch:
+        try:
+          question = Question(**pending.values)
+          Question.insert_all([question], session)
+          pending.resolve(question.format(), self.clock())
+        except Exception as error:
+          session.rollback()
+          pending.fail(error, self.clock())
+    finally:
+      session.close()